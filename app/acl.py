@@ -0,0 +1,144 @@
+import threading
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models
+from .replicas import use_primary
+
+WILDCARD = "*"
+
+
+def grant_matches(grants, resource_name: str, action: str) -> bool:
+    """Проверка по множеству (resource, action) с учётом "article:*", "*:read" и "*:*"."""
+    return ((resource_name, action) in grants or (resource_name, WILDCARD) in grants
+            or (WILDCARD, action) in grants or (WILDCARD, WILDCARD) in grants)
+
+
+class CompiledACL:
+    """Неизменяемый снимок ACL: имена ресурсов/действий -> id, роль -> множество (resource_id, permission_id).
+
+    Права ролей берутся из effective_permissions, то есть уже с учётом наследования.
+    """
+
+    __slots__ = ("version", "resource_ids", "action_ids", "grants", "_names")
+
+    def __init__(self, version: int, resource_ids: dict, action_ids: dict, grants: dict):
+        self.version = version
+        self.resource_ids = resource_ids
+        self.action_ids = action_ids
+        self.grants = grants
+        self._names = ({v: k for k, v in resource_ids.items()}, {v: k for k, v in action_ids.items()})
+
+    def allows(self, role_ids, resource_name: str, action: str) -> bool:
+        res_ids = [i for i in (self.resource_ids.get(resource_name), self.resource_ids.get(WILDCARD)) if i is not None]
+        perm_ids = [i for i in (self.action_ids.get(action), self.action_ids.get(WILDCARD)) if i is not None]
+        keys = [(r, p) for r in res_ids for p in perm_ids]
+        if not keys:
+            return False
+        for role_id in role_ids:
+            granted = self.grants.get(role_id)
+            if granted and any(key in granted for key in keys):
+                return True
+        return False
+
+    def grants_for(self, role_ids) -> frozenset:
+        resources, actions = self._names
+        return frozenset((resources[res_id], actions[perm_id])
+                         for role_id in role_ids for res_id, perm_id in self.grants.get(role_id, ()))
+
+
+def compile_acl(db: Session, version: int) -> CompiledACL:
+    # снимок с отстающей реплики получил бы новую версию со старыми правами
+    use_primary(db)
+    resource_ids = dict(db.execute(select(models.Resource.name, models.Resource.id)).all())
+    action_ids = dict(db.execute(select(models.Permission.action, models.Permission.id)).all())
+    grants = {}
+    rows = db.execute(select(models.EffectivePermission.role_id, models.EffectivePermission.resource_id,
+                             models.EffectivePermission.permission_id)).all()
+    for role_id, res_id, perm_id in rows:
+        grants.setdefault(role_id, set()).add((res_id, perm_id))
+    return CompiledACL(version, resource_ids, action_ids, {k: frozenset(v) for k, v in grants.items()})
+
+
+ACL_STATE_ID = 1
+
+
+def bump_stored_version(db: Session) -> int:
+    """Увеличивает версию ACL в acl_state и возвращает новую; изменение сразу фиксируется."""
+    use_primary(db)
+    t = models.ACLState.__table__
+    version = db.execute(t.update().where(t.c.id == ACL_STATE_ID)
+                         .values(version=t.c.version + 1, updated_at=datetime.utcnow())
+                         .returning(t.c.version)).scalar_one()
+    db.commit()
+    return version
+
+
+def stored_version(db: Session) -> int:
+    use_primary(db)
+    return db.execute(select(models.ACLState.version).where(models.ACLState.id == ACL_STATE_ID)).scalar_one()
+
+
+class ACLIndex:
+    """Держит актуальный CompiledACL; пересборка подменяет снимок целиком.
+
+    Снимок собирается без блокировки и публикуется заменой ссылки, если его версия не
+    старше текущей: при DB_ASYNC сборка идёт в run_sync, и на каждом SQL greenlet отдаёт
+    управление event loop — удерживаемый при этом threading.Lock заморозил бы весь loop.
+    Параллельные промахи могут собрать снимок несколько раз; опубликуется самый новый.
+
+    Номер версии общий для воркеров: next_version (счётчик в Redis при общем CACHE_BACKEND)
+    или строка acl_state, которую остальные воркеры сверяют в sync_stored_version.
+    listeners вызываются после каждой пересборки.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.next_version = None
+        self.listeners = []
+        self._current = None
+        # только для сравнения и замены ссылок, без ввода-вывода внутри
+        self._lock = threading.Lock()
+
+    def get(self, db: Session) -> CompiledACL:
+        current, version = self._current, self.version
+        if current is not None and current.version == version:
+            return current
+        return self._publish(compile_acl(db, version))
+
+    def rebuild(self, db: Session, version: int = None) -> CompiledACL:
+        """version — уже полученный из next_version номер: обработчики берут его в threadpool."""
+        if version is None:
+            # общий счётчик (сетевой вызов или UPDATE) — до блокировки
+            version = self.next_version() if self.next_version else bump_stored_version(db)
+        with self._lock:
+            self.version = max(self.version + 1, version)
+            version = self.version
+        compiled = self._publish(compile_acl(db, version))
+        for listener in self.listeners:
+            listener(compiled.version)
+        return compiled
+
+    def invalidate(self, version: int = None):
+        """Помечает снимок устаревшим; следующий get() соберёт его заново."""
+        with self._lock:
+            self.version = max(self.version + 1, version or 0)
+
+    def sync_stored_version(self, db: Session) -> bool:
+        """Сверка с acl_state: ACL пересобрали на другом воркере — снимок этого устарел."""
+        version = stored_version(db)
+        if version <= self.version:
+            return False
+        self.invalidate(version)
+        return True
+
+    def _publish(self, compiled: CompiledACL) -> CompiledACL:
+        with self._lock:
+            if self._current is None or compiled.version >= self._current.version:
+                self._current = compiled
+            return self._current
+
+
+acl_index = ACLIndex()
@@ -0,0 +1,180 @@
+"""Журнал событий безопасности.
+
+emit() только кладёт событие в ограниченную очередь в памяти; фоновый поток
+(PeriodicWorker в lifespan) забирает их пачками по AUDIT_BATCH_SIZE и пишет
+одним многострочным INSERT в audit_events или одной записью в NDJSON-файл.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .config import settings
+from .database import engine
+from .metrics import registry, Counter, GaugeCallback
+
+LOGIN = "login"
+LOGIN_FAILED = "login_failed"
+LOGOUT = "logout"
+ROLE_ASSIGNED = "role_assigned"
+ACCOUNT_DELETED = "account_deleted"
+ARTICLE_UPDATED = "article_updated"
+
+DROPPED = registry.register(Counter("audit_events_dropped_total", "Audit events dropped on a full queue.",
+                                    ["event"]))
+WRITTEN = registry.register(Counter("audit_events_written_total", "Audit events persisted by the writer."))
+
+
+class AuditQueue:
+    """Ограниченная очередь событий.
+
+    policy="drop" — при переполнении событие отбрасывается сразу; "block" — put() ждёт
+    место до block_timeout секунд, потом тоже отбрасывает. Ждать можно только вне
+    event loop: из обработчиков очередь наполняет emit() через offer() и, если места
+    нет, уходит в threadpool. Отброшенные события видны в audit_events_dropped_total.
+    """
+
+    def __init__(self, maxsize: int, policy: str, block_timeout: float, batch_size: int):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.batch_size = batch_size
+        self.on_batch = None
+        self._events = deque()
+        self._cond = threading.Condition()
+
+    def offer(self, event: dict) -> bool:
+        """Без ожидания при любой policy: False, если места нет (событие при этом не учтено как отброшенное)."""
+        with self._cond:
+            if len(self._events) >= self.maxsize:
+                return False
+            self._events.append(event)
+            full_batch = len(self._events) >= self.batch_size
+        if full_batch and self.on_batch is not None:
+            self.on_batch()
+        return True
+
+    def put(self, event: dict) -> bool:
+        with self._cond:
+            if len(self._events) >= self.maxsize and self.policy == "block":
+                deadline = time.monotonic() + self.block_timeout
+                while len(self._events) >= self.maxsize:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        break
+            if len(self._events) >= self.maxsize:
+                DROPPED.inc(1, event["event"])
+                return False
+            self._events.append(event)
+            full_batch = len(self._events) >= self.batch_size
+        if full_batch and self.on_batch is not None:
+            self.on_batch()
+        return True
+
+    def take(self, n: int) -> list:
+        with self._cond:
+            batch = [self._events.popleft() for _ in range(min(n, len(self._events)))]
+            self._cond.notify_all()
+        return batch
+
+    def restore(self, batch: list):
+        # неудачная запись: вернуть пачку в начало, насколько хватает места
+        with self._cond:
+            room = self.maxsize - len(self._events)
+            for event in reversed(batch[:room]):
+                self._events.appendleft(event)
+            if len(batch) > room:
+                for event in batch[room:]:
+                    DROPPED.inc(1, event["event"])
+
+    def __len__(self):
+        return len(self._events)
+
+
+class DatabaseSink:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def write(self, batch: list):
+        # executemany в одной транзакции; свой engine, а не сессия запроса
+        with self.engine.begin() as conn:
+            conn.execute(insert(models.AuditEvent.__table__), batch)
+
+
+class FileSink:
+    """NDJSON с ротацией по размеру: path, path.1, ... path.N."""
+
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    def write(self, batch: list):
+        lines = "".join(json.dumps(dict(e, created_at=e["created_at"].isoformat()), ensure_ascii=False) + "\n"
+                        for e in batch)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+            size = f.tell()
+        if self.max_bytes and size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+def _make_sink():
+    if settings.AUDIT_SINK == "file":
+        return FileSink(settings.AUDIT_FILE_PATH, settings.AUDIT_FILE_MAX_BYTES, settings.AUDIT_FILE_BACKUPS)
+    if settings.AUDIT_SINK == "db":
+        return DatabaseSink(engine)
+    return None
+
+
+enabled = settings.AUDIT_SINK != "off"
+audit_queue = AuditQueue(settings.AUDIT_QUEUE_SIZE, settings.AUDIT_QUEUE_POLICY,
+                         settings.AUDIT_BLOCK_TIMEOUT_SECONDS, settings.AUDIT_BATCH_SIZE)
+sink = _make_sink()
+
+registry.register(GaugeCallback("audit_queue_size", "Audit events waiting to be written.", [],
+                                lambda: {(): len(audit_queue)}))
+
+
+async def emit(event: str, user_id: str = None, request=None, **data):
+    """Записывает событие в очередь; на пути запроса никакого I/O и никакого ожидания в event loop."""
+    if not enabled:
+        return
+    ip = request.client.host if request is not None and request.client is not None else None
+    item = {"created_at": datetime.utcnow(), "event": event, "user_id": user_id, "ip": ip, "data": data or None}
+    if audit_queue.offer(item):
+        return
+    if audit_queue.policy == "block":
+        # очередь полна: место ждём в threadpool, а не в потоке event loop
+        await run_in_threadpool(audit_queue.put, item)
+    else:
+        DROPPED.inc(1, event)
+
+
+def flush_audit():
+    """Пишет всё накопленное пачками; при ошибке пачка возвращается в очередь."""
+    while True:
+        batch = audit_queue.take(audit_queue.batch_size)
+        if not batch:
+            return
+        try:
+            sink.write(batch)
+        except Exception:
+            audit_queue.restore(batch)
+            raise
+        WRITTEN.inc(len(batch))
@@ -0,0 +1,53 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicWorker:
+    """Фоновый поток, вызывающий fn() раз в interval секунд (или раньше — по wake())."""
+
+    def __init__(self, name: str, interval: float, fn, run_on_stop: bool = False):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.run_on_stop = run_on_stop
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self, timeout: float = None):
+        """Блокирует до завершения потока; из async-кода вызывать через run_in_threadpool."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            self._call()
+        # stop() мог прийти посреди fn(): то, что накопилось за это время, дописывает отдельный запуск
+        if self.run_on_stop:
+            self._call()
+
+    def _call(self):
+        try:
+            self.fn()
+        except Exception:
+            logger.exception("Background task %s failed", self.name)
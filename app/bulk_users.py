@@ -0,0 +1,253 @@
+"""Массовый импорт и экспорт пользователей.
+
+    python -m app.bulk_users import users.csv [--checkpoint users.csv.ckpt]
+    python -m app.bulk_users export users.ndjson [--with-password-hash]
+
+Файл читается потоком, пачками по --batch-size: в памяти не больше двух пачек
+(одна хешируется в пуле процессов, пока предыдущая пишется в БД). Колонки:
+email, password или password_hash (готовый bcrypt), first_name, last_name,
+middle_name, is_active, is_staff, roles (в CSV — имена через ";", в NDJSON — список).
+
+После каждой записанной пачки в checkpoint сохраняется число обработанных строк;
+повторный запуск с тем же checkpoint продолжает с этого места. Уже существующие
+email пропускаются, поэтому повтор пачки после сбоя ничего не дублирует.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import select
+
+from . import crud, models
+from .config import settings
+from .database import SessionFactory
+from .hashing import hash_password, hash_rounds
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("email", "first_name", "last_name", "middle_name", "is_active", "is_staff", "roles")
+_TRUE = {"1", "true", "t", "yes", "y"}
+
+
+def _format(path: str, fmt: str = None) -> str:
+    if fmt:
+        return fmt
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+def _bool(value, default: bool) -> bool:
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in _TRUE
+
+
+def read_records(f, fmt: str):
+    """Построчно: {колонка: значение}; roles всегда список."""
+    if fmt == "ndjson":
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+        return
+    for row in csv.DictReader(f):
+        row["roles"] = [r.strip() for r in (row.get("roles") or "").split(";") if r.strip()]
+        yield row
+
+
+def _hash_many(passwords: list, rounds: int) -> list:
+    return [hash_password(p, rounds) for p in passwords]
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> int:
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path) as f:
+            return json.load(f)["records"]
+
+    def save(self, records: int):
+        if not self.path:
+            return
+        # запись через временный файл: оборванный save не портит прошлый checkpoint
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"records": records, "updated_at": datetime.utcnow().isoformat()}, f)
+        os.replace(tmp, self.path)
+
+
+class UserImporter:
+    def __init__(self, role_ids: dict, pool: ProcessPoolExecutor, workers: int, rounds: int):
+        self.role_ids = role_ids
+        self.pool = pool
+        self.workers = workers
+        self.rounds = rounds
+        self.stats = {"read": 0, "created": 0, "existing": 0, "invalid": 0, "roles_assigned": 0}
+
+    def _validate(self, lineno: int, record: dict):
+        email = (record.get("email") or "").strip()
+        if "@" not in email:
+            return f"line {lineno}: invalid email"
+        if record.get("password_hash"):
+            if hash_rounds(record["password_hash"]) is None:
+                return f"line {lineno}: password_hash is not a bcrypt hash"
+        elif not record.get("password"):
+            return f"line {lineno}: password or password_hash required"
+        unknown = [r for r in record.get("roles") or () if r not in self.role_ids]
+        if unknown:
+            return f"line {lineno}: unknown roles {unknown}"
+        return None
+
+    def prepare(self, batch: list):
+        """Проверка строк и отправка паролей в пул; хеши забираются в write()."""
+        valid, passwords = [], []
+        for lineno, record in batch:
+            error = self._validate(lineno, record)
+            if error:
+                self.stats["invalid"] += 1
+                logger.warning("Skipped %s", error)
+                continue
+            valid.append(record)
+            if not record.get("password_hash"):
+                passwords.append(record["password"])
+        size = max(1, -(-len(passwords) // self.workers))
+        futures = [self.pool.submit(_hash_many, passwords[i:i + size], self.rounds)
+                   for i in range(0, len(passwords), size)]
+        return valid, futures
+
+    def write(self, db, valid: list, futures: list):
+        hashes = iter([h for f in futures for h in f.result()])
+        now = datetime.utcnow()
+        users, user_roles = [], {}
+        for record in valid:
+            user_id = models.generate_uuid()
+            users.append({
+                "id": user_id,
+                "email": record["email"].strip(),
+                "password_hash": record.get("password_hash") or next(hashes),
+                "first_name": record.get("first_name") or None,
+                "last_name": record.get("last_name") or None,
+                "middle_name": record.get("middle_name") or None,
+                "is_active": _bool(record.get("is_active"), True),
+                "is_staff": _bool(record.get("is_staff"), False),
+                "created_at": now,
+                "updated_at": now,
+            })
+            if record.get("roles"):
+                user_roles[user_id] = record["roles"]
+        created, assigned = crud.import_users_batch(db, users, user_roles, self.role_ids)
+        self.stats["created"] += created
+        self.stats["existing"] += len(users) - created
+        self.stats["roles_assigned"] += assigned
+
+
+def _batches(records, size: int):
+    it = iter(records)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_users(f, fmt: str, batch_size: int = 5000, workers: int = None, rounds: int = None,
+                 checkpoint: Checkpoint = None) -> dict:
+    checkpoint = checkpoint or Checkpoint(None)
+    workers = workers or os.cpu_count() or 1
+    rounds = rounds or settings.BCRYPT_ROUNDS
+    done = checkpoint.load()
+    records = enumerate(read_records(f, fmt), start=2 if fmt == "csv" else 1)
+    if done:
+        logger.info("Resuming after %s records", done)
+        records = islice(records, done, None)
+    with SessionFactory() as db, ProcessPoolExecutor(max_workers=workers) as pool:
+        role_ids = dict(db.execute(select(models.Role.name, models.Role.id)).all())
+        importer = UserImporter(role_ids, pool, workers, rounds)
+        pending = None
+        for batch in _batches(records, batch_size):
+            job = (len(batch), *importer.prepare(batch))
+            if pending is not None:
+                _flush(db, importer, checkpoint, done, pending)
+                done += pending[0]
+            pending = job
+        if pending is not None:
+            _flush(db, importer, checkpoint, done, pending)
+    return importer.stats
+
+
+def _flush(db, importer: UserImporter, checkpoint: Checkpoint, done: int, job: tuple):
+    count, valid, futures = job
+    importer.write(db, valid, futures)
+    checkpoint.save(done + count)
+    importer.stats["read"] = done + count
+    logger.info("Imported %s records: %s", done + count, importer.stats)
+
+
+def export_users(out, fmt: str, with_password_hash: bool = False, batch_size: int = 1000) -> int:
+    columns = ["email"] + (["password_hash"] if with_password_hash else []) + list(FIELDS[1:])
+    writer = csv.DictWriter(out, fieldnames=columns) if fmt == "csv" else None
+    if writer is not None:
+        writer.writeheader()
+    count = 0
+    with SessionFactory() as db:
+        for user, roles in crud.iter_users_for_export(db, batch_size):
+            row = {c: getattr(user, c) for c in columns if c != "roles"}
+            if fmt == "csv":
+                row["roles"] = ";".join(roles)
+                writer.writerow(row)
+            else:
+                row["roles"] = roles
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.bulk_users")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="stream users from CSV/NDJSON into the database")
+    imp.add_argument("path", help="input file, '-' for stdin")
+    imp.add_argument("--format", choices=["csv", "ndjson"])
+    imp.add_argument("--batch-size", type=int, default=5000)
+    imp.add_argument("--workers", type=int, default=None, help="hashing processes (default: CPU count)")
+    imp.add_argument("--rounds", type=int, default=None, help="bcrypt cost for plain passwords")
+    imp.add_argument("--checkpoint", default=None, help="progress file for resuming (default: <path>.ckpt)")
+    exp = sub.add_parser("export", help="stream users with role names to CSV/NDJSON")
+    exp.add_argument("path", help="output file, '-' for stdout")
+    exp.add_argument("--format", choices=["csv", "ndjson"])
+    exp.add_argument("--with-password-hash", action="store_true", help="include bcrypt hashes (for migration)")
+    exp.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    fmt = _format(args.path, args.format)
+    if args.command == "import":
+        checkpoint = Checkpoint(args.checkpoint or (None if args.path == "-" else args.path + ".ckpt"))
+        f = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+        try:
+            stats = import_users(f, fmt, args.batch_size, args.workers, args.rounds, checkpoint)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        print(json.dumps(stats))
+    elif args.command == "export":
+        out = sys.stdout if args.path == "-" else open(args.path, "w", newline="", encoding="utf-8")
+        try:
+            count = export_users(out, fmt, args.with_password_hash, args.batch_size)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(f"exported {count} users", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
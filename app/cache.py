@@ -0,0 +1,376 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+from . import tokens
+from .config import settings
+from .metrics import registry, GaugeCallback, CounterCallback
+
+logger = logging.getLogger(__name__)
+
+
+# записи в общий бэкенд, отложенные до выхода из AsyncSession.run_sync (см. database.run_db)
+_deferred_calls = contextvars.ContextVar("fastauth_deferred_backend_calls", default=None)
+
+
+def in_loop_session() -> bool:
+    """True внутри run_sync у AsyncSession: код идёт в потоке event loop, сетевые вызовы бэкенда запрещены."""
+    return _deferred_calls.get() is not None
+
+
+def call_backend(fn, *args):
+    """Запись в общий бэкенд: сразу или, внутри run_sync, после него в threadpool."""
+    pending = _deferred_calls.get()
+    if pending is None:
+        fn(*args)
+    else:
+        pending.append((fn, args))
+
+
+@contextmanager
+def deferred_backend_calls(pending: list):
+    token = _deferred_calls.set(pending)
+    try:
+        yield pending
+    finally:
+        _deferred_calls.reset(token)
+
+
+def run_deferred(pending: list):
+    for fn, args in pending:
+        fn(*args)
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кеш с ограничением по размеру и времени жизни записей."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get(self, key, count_miss: bool = True):
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._data[key]
+                if count_miss:
+                    self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: float = None):
+        if not self.enabled:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, (set, frozenset)):
+        return {"$set": [list(v) if isinstance(v, tuple) else v for v in value]}
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _decode(obj):
+    if "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    if "$set" in obj:
+        return frozenset(tuple(v) if isinstance(v, list) else v for v in obj["$set"])
+    return obj
+
+
+def dumps(value) -> str:
+    return json.dumps(value, default=_encode, separators=(",", ":"))
+
+
+def loads(raw):
+    return json.loads(raw, object_hook=_decode)
+
+
+class MemoryBackend:
+    """Общий (L2) кеш и pub/sub внутри одного процесса: замена Redis для тестов и одиночного воркера."""
+
+    def __init__(self):
+        self._data = {}
+        self._sets = {}
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, item):
+        return item is not None and (item[0] is None or item[0] > time.monotonic())
+
+    def get(self, key):
+        item = self._data.get(key)
+        return item[1] if self._alive(item) else None
+
+    def set(self, key, value, ttl: float = None):
+        self._data[key] = (time.monotonic() + ttl if ttl else None, value)
+
+    def delete(self, *keys):
+        for key in keys:
+            self._data.pop(key, None)
+            self._sets.pop(key, None)
+
+    def incr(self, key, ttl: float = None) -> int:
+        # ttl задаётся только при создании ключа: так считается фиксированное окно
+        with self._lock:
+            item = self._data.get(key)
+            if not self._alive(item):
+                item = (time.monotonic() + ttl if ttl else None, 0)
+            value = int(item[1]) + 1
+            self._data[key] = (item[0], value)
+            return value
+
+    def sadd(self, key, member, ttl: float = None):
+        with self._lock:
+            item = self._sets.get(key)
+            members = item[1] if self._alive(item) else set()
+            members.add(member)
+            self._sets[key] = (time.monotonic() + ttl if ttl else None, members)
+
+    def smembers(self, key) -> set:
+        item = self._sets.get(key)
+        return set(item[1]) if self._alive(item) else set()
+
+    def publish(self, channel, message: str):
+        for callback in list(self._subscribers.get(channel, ())):
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def close(self):
+        self._subscribers.clear()
+
+
+class RedisBackend:
+    """L2 и pub/sub поверх Redis (нужен пакет redis)."""
+
+    def __init__(self, url: str):
+        import redis
+
+        self._redis = redis.Redis.from_url(url, socket_timeout=settings.CACHE_REDIS_TIMEOUT_SECONDS)
+        self._pubsub_thread = None
+
+    def get(self, key):
+        return self._redis.get(key)
+
+    def set(self, key, value, ttl: float = None):
+        self._redis.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, *keys):
+        if keys:
+            self._redis.delete(*keys)
+
+    def incr(self, key, ttl: float = None) -> int:
+        value = self._redis.incr(key)
+        if ttl and value == 1:
+            self._redis.pexpire(key, int(ttl * 1000))
+        return value
+
+    def sadd(self, key, member, ttl: float = None):
+        pipe = self._redis.pipeline()
+        pipe.sadd(key, member)
+        if ttl:
+            pipe.pexpire(key, int(ttl * 1000))
+        pipe.execute()
+
+    def smembers(self, key) -> set:
+        return {m.decode() for m in self._redis.smembers(key)}
+
+    def publish(self, channel, message: str):
+        self._redis.publish(channel, message)
+
+    def subscribe(self, channel, callback):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{channel: lambda m: callback(m["data"].decode())})
+        self._pubsub_thread = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def close(self):
+        if self._pubsub_thread is not None:
+            self._pubsub_thread.stop()
+            self._pubsub_thread = None
+
+
+def make_backend(name: str, url: str = None):
+    if name == "local":
+        return None
+    if name == "memory":
+        return MemoryBackend()
+    if name == "redis":
+        return RedisBackend(url)
+    raise ValueError(f"Unknown cache backend {name!r}")
+
+
+class TokenCache(TTLCache):
+    """Кеш token -> снимок пользователя: L1 в процессе и необязательный общий L2.
+
+    Индекс по user_id нужен для инвалидации всех токенов пользователя.
+    Ошибки L2 не роняют запрос — кеш деградирует до L1.
+    """
+
+    PREFIX = "fastauth:tok:"
+    USER_PREFIX = "fastauth:tokuser:"
+
+    def __init__(self, maxsize: int, ttl: float, backend=None):
+        super().__init__(maxsize, ttl)
+        self.backend = backend
+        self.l2_hits = 0
+        self._by_user = {}
+
+    def get(self, key):
+        value = super().get(key)
+        # в потоке event loop только L1: L2 для async-сессий заранее читает deps в threadpool
+        if value is not None or self.backend is None or not self.enabled or in_loop_session():
+            return value
+        raw = self._l2(self.backend.get, self._remote(key))
+        if raw is None:
+            return None
+        value = loads(raw)
+        self.l2_hits += 1
+        self._set_local(key, value, (value["expires_at"] - datetime.utcnow()).total_seconds())
+        return value
+
+    def get_local(self, key):
+        """Только L1, без сетевых вызовов — можно звать из event loop.
+
+        Промах не считается: за ним следует обычный get(), который его и учтёт.
+        """
+        return super().get(key, count_miss=False)
+
+    def set(self, key, value, ttl: float = None):
+        if not self.enabled:
+            return
+        self._set_local(key, value, ttl)
+        if self.backend is not None:
+            ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+            if ttl > 0:
+                call_backend(self._set_remote, key, dumps(value), ttl, value["user"]["id"])
+
+    def _set_remote(self, key, raw: str, ttl: float, user_id):
+        self._l2(self.backend.set, self._remote(key), raw, ttl)
+        self._l2(self.backend.sadd, self.USER_PREFIX + str(user_id), self._remote(key), self.ttl)
+
+    def _set_local(self, key, value, ttl):
+        super().set(key, value, ttl)
+        with self._lock:
+            self._by_user.setdefault(value["user"]["id"], set()).add(key)
+            if len(self._by_user) > self.maxsize:
+                self._prune_index()
+
+    def invalidate_token(self, key, local_only: bool = False):
+        value = self.pop(key)
+        if value is not None:
+            with self._lock:
+                keys = self._by_user.get(value["user"]["id"])
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._by_user[value["user"]["id"]]
+        if self.backend is not None and not local_only:
+            call_backend(self._l2, self.backend.delete, self._remote(key))
+
+    def invalidate_user(self, user_id, local_only: bool = False):
+        with self._lock:
+            for key in self._by_user.pop(str(user_id), ()):
+                self._data.pop(key, None)
+        if self.backend is not None and not local_only:
+            call_backend(self._invalidate_user_remote, user_id)
+
+    def _invalidate_user_remote(self, user_id):
+        index = self.USER_PREFIX + str(user_id)
+        keys = self._l2(self.backend.smembers, index) or ()
+        self._l2(self.backend.delete, index, *keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._by_user.clear()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["l2"] = type(self.backend).__name__ if self.backend is not None else None
+        stats["l2_hits"] = self.l2_hits
+        return stats
+
+    def _remote(self, key: str) -> str:
+        # в общем бэкенде токены не лежат открытым текстом — только их дайджест
+        return self.PREFIX + tokens.digest(key).hex()
+
+    def _l2(self, fn, *args):
+        try:
+            return fn(*args)
+        except Exception:
+            logger.warning("L2 cache call %s failed", fn.__name__, exc_info=True)
+            return None
+
+    def _prune_index(self):
+        # вытесненные по LRU ключи остаются в индексе — чистим их пачкой
+        for user_id in list(self._by_user):
+            keys = {k for k in self._by_user[user_id] if k in self._data}
+            if keys:
+                self._by_user[user_id] = keys
+            else:
+                del self._by_user[user_id]
+
+
+backend = make_backend(settings.CACHE_BACKEND, settings.REDIS_URL)
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL_SECONDS, backend)
+
+registry.register(CounterCallback(
+    "token_cache_lookups_total", "Token cache lookups by result.", ["result"],
+    lambda: {("l1_hit",): token_cache.hits, ("l1_miss",): token_cache.misses, ("l2_hit",): token_cache.l2_hits},
+))
+registry.register(GaugeCallback("token_cache_entries", "Entries in the local token cache.", [],
+                                lambda: {(): len(token_cache._data)}))
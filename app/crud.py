@@ -1,9 +1,17 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, or_, insert, delete, tuple_, bindparam, union, text
 from . import models
 from datetime import datetime, timedelta
+import csv
+import io
 import secrets
+import time
 from .config import settings
+from . import tokens
+from .invalidation import invalidator
+from .acl import acl_index
+from .instrumentation import timed
+from .replicas import use_primary
 
 TOKEN_LIFETIME = timedelta(minutes=settings.TOKEN_LIFETIME_MINUTES)
 
@@ -12,9 +20,13 @@ def get_user_by_email(db: Session, email: str):
     return db.execute(select(models.User).where(models.User.email == email)).scalars().first()
 
 
-def create_user(db: Session, email: str, password: str, first_name=None, last_name=None, middle_name=None):
+def create_user(db: Session, email: str, password: str = None, first_name=None, last_name=None, middle_name=None,
+                password_hash: str = None):
     u = models.User(email=email, first_name=first_name, last_name=last_name, middle_name=middle_name)
-    u.set_password(password)
+    if password_hash is not None:
+        u.password_hash = password_hash
+    else:
+        u.set_password(password)
     db.add(u)
     db.commit()
     db.refresh(u)
@@ -25,32 +37,159 @@ def get_user(db: Session, user_id: str):
     return db.get(models.User, user_id)
 
 
-def create_token_for_user(db: Session, user: models.User):
-    token = secrets.token_urlsafe(32)
+def _evict_oldest_sessions(db: Session, user_id: str, keep: int):
+    """Отзывает самые старые активные токены пользователя сверх keep (по индексу user_id, is_active).
+
+    Один UPDATE ... WHERE id IN (подзапрос с OFFSET) RETURNING: jti и срок отозванных нужны для инвалидации.
+    """
+    t = models.AuthToken
+    oldest = (select(t.id).where(t.user_id == user_id, t.is_active == True)
+              .order_by(t.created_at.desc()).offset(keep))
+    return db.execute(t.__table__.update().where(t.id.in_(oldest)).values(is_active=False)
+                      .returning(t.jti, t.expires_at)).all()
+
+
+@timed("create_token_for_user")
+def create_token_for_user(db: Session, user: models.User, signed: bool = False):
+    """Выдаёт токен; возвращает (строка auth_tokens, ключ токена) — сам ключ в БД не хранится."""
+    token = tokens.new_jti() if signed else secrets.token_urlsafe(32)
     now = datetime.utcnow()
-    at = models.AuthToken(user_id=user.id, token=token, created_at=now, expires_at=now + TOKEN_LIFETIME)
+    at = models.AuthToken(user_id=user.id, token_digest=tokens.digest(token),
+                          jti=token[len(tokens.JTI_PREFIX):] if signed else None,
+                          created_at=now, expires_at=now + TOKEN_LIFETIME)
+    evicted = []
+    if settings.MAX_SESSIONS_PER_USER > 0:
+        evicted = _evict_oldest_sessions(db, user.id, settings.MAX_SESSIONS_PER_USER - 1)
     db.add(at)
+    # без refresh: все поля выставлены здесь или Python-умолчаниями, а expire_on_commit выключен
     db.commit()
-    db.refresh(at)
-    return at
+    for row in evicted:
+        if row.jti is not None:
+            invalidator.token_revoked(tokens.JTI_PREFIX + row.jti, tokens.timestamp(row.expires_at))
+    if any(row.jti is None for row in evicted):
+        # кеш opaque-токенов ключуется самим токеном, а в БД его нет — сбрасываем контексты пользователя целиком
+        invalidator.user_changed(user.id)
+    return at, token
 
 
 def get_token(db: Session, token_str: str):
-    return db.execute(select(models.AuthToken).where(models.AuthToken.token == token_str,
+    return db.execute(select(models.AuthToken).where(models.AuthToken.token_digest == tokens.digest(token_str),
                                                      models.AuthToken.is_active == True)).scalars().first()
 
 
-def revoke_token(db: Session, token_obj: models.AuthToken):
+def _with_grants(stmt):
+    return (
+        stmt.add_columns(models.UserRole.role_id, models.Resource.name, models.Permission.action)
+        .outerjoin(models.UserRole, models.UserRole.user_id == models.User.id)
+        # effective_permissions уже содержит унаследованные права — рекурсии нет
+        .outerjoin(models.EffectivePermission, models.EffectivePermission.role_id == models.UserRole.role_id)
+        .outerjoin(models.Resource, models.Resource.id == models.EffectivePermission.resource_id)
+        .outerjoin(models.Permission, models.Permission.id == models.EffectivePermission.permission_id)
+    )
+
+
+def _collect_grants(rows, offset: int):
+    role_ids = sorted({r[offset] for r in rows if r[offset] is not None})
+    grants = frozenset((r[offset + 1], r[offset + 2]) for r in rows
+                       if r[offset + 1] is not None and r[offset + 2] is not None)
+    return role_ids, grants
+
+
+def get_auth_context(db: Session, token_str: str):
+    """Токен, пользователь, его роли и выданные (resource, action) — одним запросом."""
+    rows = db.execute(_with_grants(
+        select(models.AuthToken, models.User)
+        .join(models.User, models.User.id == models.AuthToken.user_id)
+    ).where(models.AuthToken.token_digest == tokens.digest(token_str), models.AuthToken.is_active == True)).all()
+    if not rows:
+        return None
+    return (rows[0][0], rows[0][1]) + _collect_grants(rows, 2)
+
+
+def get_user_auth_context(db: Session, user_id: str):
+    """То же по id пользователя — для подписанных токенов, без обращения к auth_tokens."""
+    rows = db.execute(_with_grants(select(models.User)).where(models.User.id == user_id)).all()
+    if not rows:
+        return None
+    return (rows[0][0],) + _collect_grants(rows, 1)
+
+
+def revoke_token(db: Session, token_obj: models.AuthToken, token_key: str):
+    """token_key — ключ токена (opaque-строка или "jti:<id>"): по нему сбрасываются кеши."""
+    expires_at = token_obj.expires_at
     token_obj.revoke()
     db.add(token_obj)
     db.commit()
+    signed = token_key.startswith(tokens.JTI_PREFIX)
+    invalidator.token_revoked(token_key, tokens.timestamp(expires_at) if signed else None)
 
 
 def revoke_all_tokens_for_user(db: Session, user: models.User):
+    user_id = user.id
     db.execute(
-        models.AuthToken.__table__.update().where(models.AuthToken.user_id == user.id).values(is_active=False)
+        # уже отозванные строки не переписываем: (user_id, is_active) сужает UPDATE до активных
+        models.AuthToken.__table__.update().where(models.AuthToken.user_id == user_id,
+                                                  models.AuthToken.is_active == True).values(is_active=False)
     )
     db.commit()
+    now = time.time()
+    invalidator.user_revoked(user_id, now, now + TOKEN_LIFETIME.total_seconds())
+
+
+def load_revocations(db: Session):
+    """Восстанавливает denylist подписанных токенов после рестарта процесса."""
+    # отстающая реплика вернула бы неполный denylist
+    use_primary(db)
+    rows = db.execute(select(models.AuthToken.jti, models.AuthToken.expires_at).where(
+        models.AuthToken.is_active == False,
+        models.AuthToken.expires_at > datetime.utcnow(),
+        models.AuthToken.jti.is_not(None),
+    )).all()
+    for jti, expires_at in rows:
+        tokens.revocations.deny(tokens.JTI_PREFIX + jti, tokens.timestamp(expires_at))
+    return len(rows)
+
+
+def touch_tokens(db: Session, touches: dict):
+    """Пакетно продлевает токены: {token: (last_used_at, expires_at)}, executemany по BULK_CHUNK_SIZE.
+
+    Условие на last_used_at не даёт воркеру с более старыми данными откатить чужое продление.
+    """
+    table = models.AuthToken.__table__
+    stmt = table.update().where(
+        table.c.token_digest == bindparam("k"),
+        table.c.is_active == True,
+        or_(table.c.last_used_at.is_(None), table.c.last_used_at < bindparam("u")),
+    ).values(last_used_at=bindparam("u"), expires_at=bindparam("e"))
+    rows = [{"k": tokens.digest(k), "u": used_at, "e": expires_at} for k, (used_at, expires_at) in touches.items()]
+    for chunk in _chunks(rows):
+        db.execute(stmt, chunk)
+    db.commit()
+    return len(rows)
+
+
+PROFILE_FIELDS = {"first_name", "last_name", "middle_name"}
+
+
+def update_user_profile(db: Session, user: models.User, fields: dict):
+    changed = {k: v for k, v in fields.items() if k in PROFILE_FIELDS}
+    if changed:
+        for k, v in changed.items():
+            setattr(user, k, v)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        invalidator.user_changed(user.id)
+    return user
+
+
+def soft_delete_user(db: Session, user: models.User):
+    user_id = user.id
+    user.soft_delete()
+    db.add(user)
+    db.commit()
+    invalidator.user_changed(user_id)
+    revoke_all_tokens_for_user(db, user)
 
 
 def create_role(db: Session, name: str, description: str = None):
@@ -80,6 +219,8 @@ def create_permission(db: Session, action: str, description: str = None):
 def create_role_permission(db: Session, role_id: int, resource_id: int, permission_id: int):
     rp = models.RolePermission(role_id=role_id, resource_id=resource_id, permission_id=permission_id)
     db.add(rp)
+    db.flush()
+    _grant_effective(db, [{"role_id": role_id, "resource_id": resource_id, "permission_id": permission_id}])
     db.commit()
     db.refresh(rp)
     return rp
@@ -90,24 +231,387 @@ def assign_role_to_user(db: Session, user_id: str, role_id: int):
     db.add(ur)
     db.commit()
     db.refresh(ur)
+    invalidator.user_changed(user_id)
     return ur
 
 
+def _descendants(db: Session, role_ids) -> set:
+    """Сами роли и все, кто их наследует."""
+    role_ids = set(role_ids)
+    rows = db.execute(select(models.RoleClosure.descendant_id)
+                      .where(models.RoleClosure.ancestor_id.in_(role_ids))).scalars()
+    return role_ids | set(rows)
+
+
+def _grant_effective(db: Session, grants: list[dict]):
+    """Новые прямые права добавляются роли и всем её потомкам — без пересчёта остального."""
+    below = {g["role_id"]: {g["role_id"]} for g in grants}
+    for chunk in _chunks(list(below)):
+        for ancestor, descendant in db.execute(select(models.RoleClosure.ancestor_id, models.RoleClosure.descendant_id)
+                                               .where(models.RoleClosure.ancestor_id.in_(chunk))):
+            below[ancestor].add(descendant)
+    rows = {(role_id, g["resource_id"], g["permission_id"]) for g in grants for role_id in below[g["role_id"]]}
+    values = [{"role_id": r, "resource_id": res, "permission_id": p} for r, res, p in rows]
+    for chunk in _chunks(values):
+        db.execute(_insert_ignore(db, models.EffectivePermission).values(chunk))
+
+
+def _refresh_roles(db: Session, role_ids: set):
+    """Пересчитывает замыкание и эффективные права для role_ids по текущим role_parents."""
+    parents = {}
+    for child, parent in db.execute(select(models.RoleParent.role_id, models.RoleParent.parent_role_id)):
+        parents.setdefault(child, set()).add(parent)
+    closure = []
+    for role_id in role_ids:
+        seen, stack = set(), list(parents.get(role_id, ()))
+        while stack:
+            ancestor = stack.pop()
+            if ancestor not in seen:
+                seen.add(ancestor)
+                stack.extend(parents.get(ancestor, ()))
+        closure.extend({"ancestor_id": a, "descendant_id": role_id} for a in seen)
+    for chunk in _chunks(list(role_ids)):
+        db.execute(delete(models.RoleClosure).where(models.RoleClosure.descendant_id.in_(chunk)))
+        db.execute(delete(models.EffectivePermission).where(models.EffectivePermission.role_id.in_(chunk)))
+    for chunk in _chunks(closure):
+        db.execute(insert(models.RoleClosure).values(chunk))
+    rp, rc = models.RolePermission, models.RoleClosure
+    for chunk in _chunks(list(role_ids)):
+        own = select(rp.role_id, rp.resource_id, rp.permission_id).where(rp.role_id.in_(chunk))
+        inherited = (select(rc.descendant_id, rp.resource_id, rp.permission_id)
+                     .join(rp, rp.role_id == rc.ancestor_id).where(rc.descendant_id.in_(chunk)))
+        db.execute(insert(models.EffectivePermission).from_select(
+            ["role_id", "resource_id", "permission_id"], union(own, inherited)))
+
+
+def add_role_parent(db: Session, role_id: int, parent_role_id: int):
+    """role_id начинает наследовать права parent_role_id. ValueError — неизвестная роль или цикл."""
+    found = set(db.execute(select(models.Role.id).where(models.Role.id.in_([role_id, parent_role_id]))).scalars())
+    if found != {role_id, parent_role_id}:
+        raise ValueError("Unknown role.")
+    if role_id == parent_role_id or db.get(models.RoleClosure, (role_id, parent_role_id)) is not None:
+        raise ValueError("Role inheritance cycle.")
+    if db.get(models.RoleParent, (role_id, parent_role_id)) is None:
+        db.add(models.RoleParent(role_id=role_id, parent_role_id=parent_role_id))
+        db.flush()
+        # затрагивает только саму роль и её потомков
+        _refresh_roles(db, _descendants(db, [role_id]))
+    db.commit()
+
+
+def remove_role_parent(db: Session, role_id: int, parent_role_id: int) -> bool:
+    edge = db.get(models.RoleParent, (role_id, parent_role_id))
+    if edge is None:
+        return False
+    affected = _descendants(db, [role_id])
+    db.delete(edge)
+    db.flush()
+    _refresh_roles(db, affected)
+    db.commit()
+    return True
+
+
+def rebuild_role_closure(db: Session) -> int:
+    """Полный пересчёт role_closure и effective_permissions — для починки после ручных правок БД."""
+    role_ids = set(db.execute(select(models.Role.id)).scalars())
+    _refresh_roles(db, role_ids)
+    db.commit()
+    return len(role_ids)
+
+
+BULK_CHUNK_SIZE = 500
+
+
+def _chunks(items, size=BULK_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _insert_ignore(db: Session, model):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(model)
+    return dialect_insert(model).on_conflict_do_nothing()
+
+
+def _existing_ids(db: Session, model, key_cols: tuple, keys: list) -> dict:
+    cols = [getattr(model, c) for c in key_cols]
+    found = {}
+    for chunk in _chunks(keys):
+        cond = cols[0].in_([k[0] for k in chunk]) if len(cols) == 1 else tuple_(*cols).in_(chunk)
+        for row in db.execute(select(model.id, *cols).where(cond)):
+            found[tuple(row[1:])] = row[0]
+    return found
+
+
+def _missing_refs(db: Session, col, values) -> set:
+    values = set(values)
+    found = set()
+    for chunk in _chunks(list(values)):
+        found.update(db.execute(select(col).where(col.in_(chunk))).scalars())
+    return values - found
+
+
+def bulk_insert(db: Session, model, key_cols: tuple, rows: list[dict], refs: dict = None,
+                on_insert=None) -> list[dict]:
+    """Вставляет rows одной транзакцией (multi-row INSERT ... ON CONFLICT DO NOTHING).
+
+    Возвращает результат по каждому элементу: created / exists / error.
+    refs: {имя поля: колонка-справочник} — элементы с несуществующими ссылками получают error.
+    on_insert(db, rows) вызывается в той же транзакции со вставленными строками.
+    """
+    results = [None] * len(rows)
+    for field, col in (refs or {}).items():
+        missing = _missing_refs(db, col, (r[field] for r in rows))
+        for i, r in enumerate(rows):
+            if results[i] is None and r[field] in missing:
+                results[i] = {"index": i, "status": "error", "detail": f"Unknown {field}: {r[field]}"}
+    keys = [tuple(r[c] for c in key_cols) for r in rows]
+    pending = [i for i in range(len(rows)) if results[i] is None]
+    existing = _existing_ids(db, model, key_cols, list({keys[i] for i in pending}))
+    to_insert, seen = [], set()
+    for i in pending:
+        if keys[i] not in existing and keys[i] not in seen:
+            seen.add(keys[i])
+            to_insert.append(rows[i])
+    for chunk in _chunks(to_insert):
+        db.execute(_insert_ignore(db, model).values(chunk))
+    created = _existing_ids(db, model, key_cols, list(seen)) if seen else {}
+    if on_insert is not None and to_insert:
+        on_insert(db, to_insert)
+    db.commit()
+    for i in pending:
+        if keys[i] in seen and keys[i] in created:
+            results[i] = {"index": i, "status": "created", "id": created[keys[i]]}
+            seen.discard(keys[i])
+        else:
+            results[i] = {"index": i, "status": "exists", "id": existing.get(keys[i], created.get(keys[i]))}
+    return results
+
+
+def bulk_create_roles(db: Session, items: list[dict]):
+    return bulk_insert(db, models.Role, ("name",), items)
+
+
+def bulk_create_resources(db: Session, items: list[dict]):
+    return bulk_insert(db, models.Resource, ("name",), items)
+
+
+def bulk_create_permissions(db: Session, items: list[dict]):
+    return bulk_insert(db, models.Permission, ("action",), items)
+
+
+def bulk_create_role_permissions(db: Session, items: list[dict]):
+    return bulk_insert(db, models.RolePermission, ("role_id", "resource_id", "permission_id"), items,
+                       refs={"role_id": models.Role.id, "resource_id": models.Resource.id,
+                             "permission_id": models.Permission.id},
+                       on_insert=_grant_effective)
+
+
+def bulk_assign_roles(db: Session, items: list[dict]):
+    results = bulk_insert(db, models.UserRole, ("user_id", "role_id"), items,
+                          refs={"user_id": models.User.id, "role_id": models.Role.id})
+    for user_id in {i["user_id"] for i in items}:
+        invalidator.user_changed(user_id)
+    return results
+
+
+USER_IMPORT_COLUMNS = ("id", "email", "password_hash", "first_name", "last_name", "middle_name", "is_active",
+                       "is_staff", "created_at", "updated_at")
+
+
+def _copy_users(db: Session, users: list[dict]) -> int:
+    """COPY во временную таблицу и INSERT ... SELECT ON CONFLICT DO NOTHING (PostgreSQL + psycopg2)."""
+    buf = io.StringIO()
+    # QUOTE_NONNUMERIC: None пишется без кавычек и читается COPY как NULL, "" — как пустая строка
+    writer = csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC)
+    for u in users:
+        writer.writerow([u[c] for c in USER_IMPORT_COLUMNS])
+    buf.seek(0)
+    columns = ", ".join(USER_IMPORT_COLUMNS)
+    db.execute(text("CREATE TEMP TABLE IF NOT EXISTS users_import (LIKE users INCLUDING DEFAULTS) "
+                    "ON COMMIT DELETE ROWS"))
+    cursor = db.connection().connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY users_import ({columns}) FROM STDIN WITH (FORMAT csv)", buf)
+    finally:
+        cursor.close()
+    return db.execute(text(f"INSERT INTO users ({columns}) SELECT {columns} FROM users_import "
+                           f"ON CONFLICT (email) DO NOTHING")).rowcount
+
+
+def _supports_copy(db: Session) -> bool:
+    bind = db.get_bind()
+    return bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2"
+
+
+def import_users_batch(db: Session, users: list[dict], user_roles: dict, role_ids: dict) -> tuple[int, int]:
+    """Пачка пользователей и их ролей одной транзакцией; email, который уже есть в базе, пропускается.
+
+    users — готовые строки users (id и password_hash посчитаны заранее), user_roles — {id из users: [имя роли]},
+    role_ids — {имя роли: id}. Роли выдаются только пользователям, созданным этой пачкой: строка
+    импорта не добавляет прав существующему аккаунту. Возвращает (создано пользователей, выдано ролей).
+    """
+    if _supports_copy(db):
+        created = _copy_users(db, users)
+    else:
+        created = sum(db.execute(_insert_ignore(db, models.User).values(chunk)).rowcount for chunk in _chunks(users))
+    assigned = 0
+    if user_roles:
+        # id выданы этой пачкой: в базе есть только у вставленных строк, пропущенные email сохранили свои
+        inserted = set()
+        for chunk in _chunks(list(user_roles)):
+            inserted.update(db.execute(select(models.User.id).where(models.User.id.in_(chunk))).scalars())
+        rows = [{"user_id": user_id, "role_id": role_ids[name]}
+                for user_id, names in user_roles.items() if user_id in inserted for name in names]
+        for chunk in _chunks(rows):
+            assigned += db.execute(_insert_ignore(db, models.UserRole).values(chunk)).rowcount
+    db.commit()
+    return created, assigned
+
+
+def iter_users_for_export(db: Session, batch_size: int = 1000):
+    """Пользователи с именами ролей, keyset-пагинацией по id: память и длина транзакции не зависят от объёма."""
+    last_id = None
+    while True:
+        q = select(models.User).order_by(models.User.id).limit(batch_size)
+        if last_id is not None:
+            q = q.where(models.User.id > last_id)
+        users = db.execute(q).scalars().all()
+        if not users:
+            return
+        roles = {}
+        for user_id, name in db.execute(select(models.UserRole.user_id, models.Role.name)
+                                        .join(models.Role, models.Role.id == models.UserRole.role_id)
+                                        .where(models.UserRole.user_id.in_([u.id for u in users]))
+                                        .order_by(models.Role.name)):
+            roles.setdefault(user_id, []).append(name)
+        for u in users:
+            yield u, roles.get(u.id, [])
+        last_id = users[-1].id
+        # не держим в identity map уже отданные объекты
+        db.expunge_all()
+        db.rollback()
+
+
+def _keyset_page(db: Session, q, key, after, limit: int) -> list[dict]:
+    """Seek-пагинация: WHERE key > after ORDER BY key LIMIT n — стоимость не растёт с номером страницы."""
+    if after is not None:
+        q = q.where(key > after)
+    return [dict(row._mapping) for row in db.execute(q.order_by(key).limit(limit))]
+
+
+def list_users(db: Session, after: str = None, limit: int = 100, is_active: bool = None, role_id: int = None):
+    u = models.User
+    q = select(u.id, u.email, u.first_name, u.last_name, u.middle_name, u.is_active, u.is_staff, u.created_at)
+    if is_active is not None:
+        q = q.where(u.is_active == is_active)
+    if role_id is not None:
+        q = q.where(select(models.UserRole.id).where(models.UserRole.user_id == u.id,
+                                                     models.UserRole.role_id == role_id).exists())
+    return _keyset_page(db, q, u.id, after, limit)
+
+
+def list_roles(db: Session, after: int = None, limit: int = 100):
+    r = models.Role
+    return _keyset_page(db, select(r.id, r.name, r.description), r.id, after, limit)
+
+
+def list_role_permissions(db: Session, after: int = None, limit: int = 100, role_id: int = None):
+    rp = models.RolePermission
+    q = (select(rp.id, rp.role_id, rp.resource_id, models.Resource.name.label("resource"), rp.permission_id,
+                models.Permission.action)
+         .join(models.Resource, models.Resource.id == rp.resource_id)
+         .join(models.Permission, models.Permission.id == rp.permission_id))
+    if role_id is not None:
+        q = q.where(rp.role_id == role_id)
+    return _keyset_page(db, q, rp.id, after, limit)
+
+
+def list_user_roles(db: Session, after: int = None, limit: int = 100, user_id: str = None, role_id: int = None):
+    ur = models.UserRole
+    q = select(ur.id, ur.user_id, ur.role_id)
+    if user_id is not None:
+        q = q.where(ur.user_id == user_id)
+    if role_id is not None:
+        q = q.where(ur.role_id == role_id)
+    return _keyset_page(db, q, ur.id, after, limit)
+
+
+def list_tokens(db: Session, after: str = None, limit: int = 100, user_id: str = None, active_only: bool = False):
+    """Метаданные токенов; само значение токена наружу не отдаётся."""
+    t = models.AuthToken
+    q = select(t.id, t.user_id, t.created_at, t.expires_at, t.last_used_at, t.is_active)
+    if user_id is not None:
+        q = q.where(t.user_id == user_id)
+    if active_only:
+        q = q.where(t.is_active == True, t.expires_at > datetime.utcnow())
+    return _keyset_page(db, q, t.id, after, limit)
+
+
+def end_read(db: Session):
+    # между пачками выгрузки соединение возвращается в пул, а не держит транзакцию на всё время потока
+    db.rollback()
+
+
 def get_user_role_ids(db: Session, user_id: str):
     rows = db.execute(select(models.UserRole.role_id).where(models.UserRole.user_id == user_id)).scalars().all()
     return rows
 
 
 def check_role_permission(db: Session, role_ids: list[int], resource_name: str, action: str) -> bool:
-    res = db.execute(select(models.Resource).where(models.Resource.name == resource_name)).scalars().first()
-    perm = db.execute(select(models.Permission).where(models.Permission.action == action)).scalars().first()
-    if not res or not perm:
-        return False
-    rows = db.execute(
-        select(models.RolePermission).where(
-            models.RolePermission.role_id.in_(role_ids),
-            models.RolePermission.resource_id == res.id,
-            models.RolePermission.permission_id == perm.id
-        )
-    ).scalars().first()
-    return rows is not None
+    # скомпилированный снимок effective_permissions: поиск по словарю, без запросов и рекурсии
+    return acl_index.get(db).allows(role_ids, resource_name, action)
+
+
+def check_permissions_batch(db: Session, checks: list) -> list[bool]:
+    """checks: [(user_id | None, token | None, resource, action)] -> вектор решений.
+
+    Токены и пользователи разрешаются двумя set-based запросами, сами проверки —
+    проход по скомпилированному ACL.
+    """
+    now = datetime.utcnow()
+    token_users = {}
+    opaque = set()
+    for _, token_str, _, _ in checks:
+        if not token_str or token_str in token_users:
+            continue
+        if tokens.is_signed(token_str):
+            claims = tokens.decode(token_str)
+            ok = claims is not None and not tokens.revocations.is_revoked(claims)
+            token_users[token_str] = claims["sub"] if ok else None
+        elif not token_str.startswith(tokens.JTI_PREFIX):
+            opaque.add(token_str)
+    by_digest = {tokens.digest(t): t for t in opaque}
+    for chunk in _chunks(list(by_digest)):
+        rows = db.execute(select(models.AuthToken.token_digest, models.AuthToken.user_id).where(
+            models.AuthToken.token_digest.in_(chunk), models.AuthToken.is_active == True,
+            models.AuthToken.expires_at > now)).all()
+        token_users.update((by_digest[d], user_id) for d, user_id in rows)
+
+    subjects = [user_id if user_id else token_users.get(token_str) for user_id, token_str, _, _ in checks]
+    users = {}
+    for chunk in _chunks(list({u for u in subjects if u})):
+        rows = db.execute(
+            select(models.User.id, models.User.is_active, models.User.is_staff, models.UserRole.role_id)
+            .outerjoin(models.UserRole, models.UserRole.user_id == models.User.id)
+            .where(models.User.id.in_(chunk))
+        ).all()
+        for user_id, is_active, is_staff, role_id in rows:
+            entry = users.setdefault(user_id, [is_active, is_staff, []])
+            if role_id is not None:
+                entry[2].append(role_id)
+
+    acl = acl_index.get(db)
+    decisions = []
+    for subject, (_, _, resource_name, action) in zip(subjects, checks):
+        entry = users.get(subject)
+        if entry is None or not entry[0]:
+            decisions.append(False)
+        else:
+            decisions.append(bool(entry[1]) or acl.allows(entry[2], resource_name, action))
+    return decisions
@@ -0,0 +1,50 @@
+"""Асинхронные версии функций crud.
+
+Запросы описаны один раз в crud.py; здесь они выполняются через
+AsyncSession.run_sync (DB_ASYNC=true) или в threadpool поверх обычной Session.
+"""
+import functools
+
+from . import crud
+from .database import run_db
+
+
+def _async(fn):
+    @functools.wraps(fn)
+    async def wrapper(db, *args, **kwargs):
+        return await run_db(db, fn, *args, **kwargs)
+
+    return wrapper
+
+
+get_user_by_email = _async(crud.get_user_by_email)
+create_user = _async(crud.create_user)
+get_user = _async(crud.get_user)
+create_token_for_user = _async(crud.create_token_for_user)
+get_token = _async(crud.get_token)
+get_auth_context = _async(crud.get_auth_context)
+revoke_token = _async(crud.revoke_token)
+revoke_all_tokens_for_user = _async(crud.revoke_all_tokens_for_user)
+update_user_profile = _async(crud.update_user_profile)
+soft_delete_user = _async(crud.soft_delete_user)
+create_role = _async(crud.create_role)
+create_resource = _async(crud.create_resource)
+create_permission = _async(crud.create_permission)
+create_role_permission = _async(crud.create_role_permission)
+add_role_parent = _async(crud.add_role_parent)
+remove_role_parent = _async(crud.remove_role_parent)
+assign_role_to_user = _async(crud.assign_role_to_user)
+bulk_create_roles = _async(crud.bulk_create_roles)
+bulk_create_resources = _async(crud.bulk_create_resources)
+bulk_create_permissions = _async(crud.bulk_create_permissions)
+bulk_create_role_permissions = _async(crud.bulk_create_role_permissions)
+bulk_assign_roles = _async(crud.bulk_assign_roles)
+list_users = _async(crud.list_users)
+list_roles = _async(crud.list_roles)
+list_role_permissions = _async(crud.list_role_permissions)
+list_user_roles = _async(crud.list_user_roles)
+list_tokens = _async(crud.list_tokens)
+end_read = _async(crud.end_read)
+get_user_role_ids = _async(crud.get_user_role_ids)
+check_role_permission = _async(crud.check_role_permission)
+check_permissions_batch = _async(crud.check_permissions_batch)
@@ -1,9 +1,182 @@
+import time
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base, scoped_session
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from starlette.concurrency import run_in_threadpool
+from .cache import deferred_backend_calls, run_deferred
 from .config import settings
+from .metrics import registry, Histogram, GaugeCallback
+from .instrumentation import instrument_engine
+from . import query_budget
+from .replicas import ReplicaSet, routing_session_class, register_health_metric
+
+POOL_CHECKOUT_WAIT = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.", ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+))
+
+_pools = {}
+
+
+def _pool_stats():
+    values = {}
+    for name, pool in _pools.items():
+        values[(name, "checked_out")] = pool.checkedout()
+        values[(name, "idle")] = pool.checkedin()
+        values[(name, "overflow")] = max(pool.overflow(), 0)
+        values[(name, "size")] = pool.size()
+    return values
+
+
+registry.register(GaugeCallback("db_pool_connections", "Pooled connections by state.", ["pool", "state"],
+                                _pool_stats))
+
+
+def _timed(pool_cls):
+    class TimedPool(pool_cls):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start, self.logging_name or "default")
+
+    TimedPool.__name__ = TimedPool.__qualname__ = "Timed" + pool_cls.__name__
+    return TimedPool
+
+
+TimedQueuePool = _timed(QueuePool)
+TimedAsyncAdaptedQueuePool = _timed(AsyncAdaptedQueuePool)
+
+
+def engine_options(url: str, name: str, is_async: bool = False) -> dict:
+    u = make_url(url)
+    if u.get_backend_name() == "sqlite":
+        # у SQLite свой пул по умолчанию, размеры и таймауты к нему неприменимы
+        return {}
+    options = {
+        "poolclass": TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        "pool_logging_name": name,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    if settings.DB_STATEMENT_TIMEOUT_MS and u.get_backend_name() == "postgresql":
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+def track_pool(name: str, engine):
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        _pools[name] = pool
+
+
+def _make_engine(url: str, name: str):
+    e = create_engine(url, future=True, **engine_options(url, name))
+    track_pool(name, e)
+    instrument_engine(e)
+    query_budget.install(e)
+    return e
+
+
+engine = _make_engine(settings.DATABASE_URL, "primary")
+replicas = ReplicaSet([_make_engine(url, f"replica{i}") for i, url in enumerate(settings.DATABASE_REPLICA_URLS)],
+                      settings.REPLICA_RETRY_SECONDS)
+query_budget.install_session_hooks()
+register_health_metric(replicas)
 
-engine = create_engine(settings.DATABASE_URL, future=True)
+# expire_on_commit=False: deps.release_connection завершает транзакцию чтения посреди запроса,
+# уже загруженные объекты при этом не должны перечитываться (так же, как у AsyncSessionFactory)
+SessionFactory = sessionmaker(bind=engine, class_=routing_session_class(engine, replicas), autoflush=False,
+                              autocommit=False, expire_on_commit=False, future=True)
 
-SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True))
+# thread-local сессия для скриптов; запросы получают собственную сессию через deps.get_db
+SessionLocal = scoped_session(SessionFactory)
 
 Base = declarative_base()
+
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def async_database_url(url: str) -> str:
+    u = make_url(url)
+    backend = u.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend!r}")
+    return u.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+async_engine = None
+AsyncSessionFactory = None
+
+if settings.DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    def _make_async_engine(url: str, name: str):
+        url = async_database_url(url)
+        e = create_async_engine(url, **engine_options(url, name, is_async=True))
+        track_pool(name, e.sync_engine)
+        instrument_engine(e.sync_engine)
+        query_budget.install(e.sync_engine)
+        return e
+
+    async_engine = _make_async_engine(settings.DATABASE_URL, "primary_async")
+    async_replicas = ReplicaSet([_make_async_engine(url, f"replica{i}_async").sync_engine
+                                 for i, url in enumerate(settings.DATABASE_REPLICA_URLS)],
+                                settings.REPLICA_RETRY_SECONDS)
+    # expire_on_commit=False: после commit атрибуты читаются без неявного IO вне greenlet
+    AsyncSessionFactory = async_sessionmaker(
+        async_engine, autoflush=False, expire_on_commit=False,
+        sync_session_class=routing_session_class(async_engine.sync_engine, async_replicas))
+    register_health_metric(async_replicas)
+
+
+class LazySession:
+    """Сессия запроса, которая создаётся при первом обращении.
+
+    Один объект на запрос (Depends кеширует deps.get_db), все атрибуты проксируются
+    в настоящую Session/AsyncSession. Синхронная она или нет, известно заранее по
+    фабрике (is_async), поэтому проверка вида сессии её не создаёт.
+    """
+
+    __slots__ = ("_factory", "_session", "is_async")
+
+    def __init__(self, factory, is_async: bool = False):
+        self._factory = factory
+        self._session = None
+        self.is_async = is_async
+
+    def __getattr__(self, name):
+        if self._session is None:
+            self._session = self._factory()
+        return getattr(self._session, name)
+
+    @property
+    def started(self) -> bool:
+        return self._session is not None
+
+
+def is_async_session(db) -> bool:
+    return db.is_async if isinstance(db, LazySession) else hasattr(db, "run_sync")
+
+
+async def run_db(db, fn, *args, **kwargs):
+    """Выполняет синхронную функцию вида fn(session, ...) не блокируя event loop."""
+    if not is_async_session(db):
+        return await run_in_threadpool(fn, db, *args, **kwargs)
+    # run_sync идёт в потоке event loop: записи в общий бэкенд копятся и уходят в threadpool после него
+    pending = []
+    try:
+        with deferred_backend_calls(pending):
+            return await db.run_sync(fn, *args, **kwargs)
+    finally:
+        if pending:
+            await run_in_threadpool(run_deferred, pending)
@@ -1,34 +1,251 @@
+from contextlib import asynccontextmanager
+
 from fastapi import Depends, HTTPException, status, Request
-from .database import SessionLocal
-from sqlalchemy.orm import Session
-from . import crud, models
+from .database import SessionFactory, AsyncSessionFactory, LazySession, run_db, is_async_session
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, make_transient_to_detached
+from . import crud, models, tokens
+from .acl import acl_index, grant_matches
+from .cache import token_cache
+from .config import settings
+from .instrumentation import timed
+from .replicas import sticky, use_primary
+from .sliding import token_touches
 from datetime import datetime
-from typing import Any
+from typing import Any, Optional
 
 
-def get_db():
-    db = SessionLocal()
+async def get_db():
+    db = LazySession(AsyncSessionFactory or SessionFactory, is_async=AsyncSessionFactory is not None)
     try:
         yield db
     finally:
-        db.close()
+        if db.started:
+            if db.is_async:
+                await db.close()
+            else:
+                await run_in_threadpool(db.close)
+
+
+def release_connection(db: Session):
+    """Завершает транзакцию чтения: соединение сразу возвращается в пул, а не в конце ответа.
+
+    Незаписанные изменения не трогаются; следующий запрос к БД возьмёт соединение заново.
+    """
+    if isinstance(db, LazySession) and not db.started:
+        return
+    if db.in_transaction() and not (db.new or db.dirty or db.deleted):
+        db.commit()
+
+
+# сессия вне Depends — для потоковых ответов, которые читают БД дольше жизни зависимостей запроса
+db_session = asynccontextmanager(get_db)
+
+
+def user_snapshot(user: models.User) -> dict:
+    return {c.key: getattr(user, c.key) for c in models.User.__mapper__.column_attrs}
+
+
+def user_from_snapshot(data: dict) -> models.User:
+    # detached-объект без SELECT и без сессии; crud, который его меняет, присоединяет его через db.add
+    user = models.User(**data)
+    make_transient_to_detached(user)
+    return user
+
 
+class AuthContext:
+    """Результат аутентификации на время запроса: пользователь, его роли и выданные права."""
 
-def get_current_user(request: Request, db: Session = Depends(get_db)) -> Any:
+    def __init__(self, token_str: str, user: models.User, role_ids: list, grants: frozenset,
+                 token: Optional[models.AuthToken] = None, token_key: Optional[str] = None,
+                 issued_at: Optional[datetime] = None):
+        self.token_str = token_str
+        # ключ строки auth_tokens и кеша: сам opaque-токен или "jti:<id>" для подписанного
+        self.token_key = token_key or token_str
+        self.user = user
+        self.role_ids = role_ids
+        self.grants = grants
+        self.token = token
+        self.issued_at = issued_at
+
+    def has_permission(self, resource_name: str, action: str) -> bool:
+        return grant_matches(self.grants, resource_name, action)
+
+
+def _token_from_header(request: Request) -> str:
     auth = request.headers.get("Authorization")
     if not auth or not auth.startswith("Token "):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Authentication credentials were not provided.")
-    token_str = auth[len("Token "):].strip()
-    token_obj = crud.get_token(db, token_str)
-    if not token_obj:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token.")
-    if token_obj.expires_at < datetime.utcnow():
-        token_obj.is_active = False
-        db.add(token_obj)
-        db.commit()
+    return auth[len("Token "):].strip()
+
+
+def _invalid_token():
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token.")
+
+
+def _context_from_cache(db: Session, token_str: str, token_key: str):
+    cached = token_cache.get(token_key)
+    if cached is None:
+        return None
+    if cached["expires_at"] < datetime.utcnow():
+        token_cache.invalidate_token(token_key)
+        return None
+    grants = cached["grants"]
+    if cached["acl_version"] != acl_index.version:
+        compiled = acl_index.get(db)
+        grants = compiled.grants_for(cached["role_ids"])
+        # иначе каждый следующий запрос с этим токеном снова мимо быстрого пути и снова пересчитывает права
+        token_cache.set(token_key, dict(cached, grants=grants, acl_version=compiled.version),
+                        ttl=(cached["expires_at"] - datetime.utcnow()).total_seconds())
+    return AuthContext(token_str, user_from_snapshot(cached["user"]), cached["role_ids"], grants,
+                       token_key=token_key, issued_at=cached.get("created_at"))
+
+
+def _token_key(token_str: str) -> str:
+    """Ключ кеша: сам opaque-токен или "jti:<id>"; подпись и отзыв подписанного проверяются здесь же."""
+    if tokens.is_signed(token_str):
+        claims = tokens.decode(token_str)
+        if claims is None or tokens.revocations.is_revoked(claims):
+            raise _invalid_token()
+        return tokens.JTI_PREFIX + claims["jti"]
+    if token_str.startswith(tokens.JTI_PREFIX):
+        raise _invalid_token()
+    return token_str
+
+
+def _context_from_memory(token_str: str, token_key: str) -> Optional[AuthContext]:
+    """Контекст без БД, сети и threadpool: L1-кеш процесса.
+
+    None — нужен полный путь (_load_auth_context): промах L1, L2, устаревшая версия ACL.
+    """
+    cached = token_cache.get_local(token_key)
+    if cached is None or cached["expires_at"] < datetime.utcnow() or cached["acl_version"] != acl_index.version:
+        return None
+    return AuthContext(token_str, user_from_snapshot(cached["user"]), cached["role_ids"], cached["grants"],
+                       token_key=token_key, issued_at=cached.get("created_at"))
+
+
+def _prefetch_shared(token_key: str):
+    """Сетевые чтения до run_sync у AsyncSession: запись L2 и общая sticky-метка оседают в памяти процесса."""
+    token_cache.get(token_key)
+    sticky.is_sticky(token_key)
+
+
+def _touch(ctx: AuthContext):
+    if settings.TOKEN_SLIDING_EXPIRY and ctx.issued_at is not None:
+        # продление только копится в памяти; в БД его пишет фоновый flush пачками
+        token_touches.touch(ctx.token_str, ctx.issued_at)
+
+
+def _remember(token_key: str, user: models.User, role_ids: list, grants: frozenset, expires_at: datetime,
+              created_at: datetime = None):
+    token_cache.set(token_key, {"user": user_snapshot(user), "expires_at": expires_at, "role_ids": role_ids,
+                                "grants": grants, "acl_version": acl_index.version, "created_at": created_at},
+                    ttl=(expires_at - datetime.utcnow()).total_seconds())
+
+
+def _read_with_fallback(db: Session, fn, *args):
+    """Чтение с реплики; промах или отказ реплики повторяется на primary.
+
+    Промах — запись могла ещё не доехать до реплики; упавшая реплика уже выведена
+    из ротации обработчиком handle_error, запрос при этом не теряется.
+    """
+    if not settings.DATABASE_REPLICA_URLS or db.info.get("use_primary"):
+        return fn(db, *args)
+    try:
+        loaded = fn(db, *args)
+    except OperationalError:
+        db.rollback()
+        loaded = None
+    if loaded is None:
+        use_primary(db)
+        loaded = fn(db, *args)
+    return loaded
+
+
+def _load_signed_context(db: Session, token_str: str) -> AuthContext:
+    # подпись и срок проверяются в CPU; auth_tokens не читается вообще
+    claims = tokens.decode(token_str)
+    if claims is None or tokens.revocations.is_revoked(claims):
+        raise _invalid_token()
+    token_key = tokens.JTI_PREFIX + claims["jti"]
+    ctx = _context_from_cache(db, token_str, token_key)
+    if ctx is not None:
+        return ctx
+    if sticky.is_sticky(token_key):
+        # как и для opaque: после логина или изменения профиля реплика может отставать
+        use_primary(db)
+    loaded = _read_with_fallback(db, crud.get_user_auth_context, claims["sub"])
+    if not loaded or not loaded[0].is_active:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User inactive.")
+    user, role_ids, grants = loaded
+    _remember(token_key, user, role_ids, grants, datetime.utcfromtimestamp(claims["exp"]))
+    return AuthContext(token_str, user, role_ids, grants, token_key=token_key)
+
+
+def _load_opaque_context(db: Session, token_str: str) -> AuthContext:
+    if token_str.startswith(tokens.JTI_PREFIX):
+        raise _invalid_token()
+    ctx = _context_from_cache(db, token_str, token_str)
+    if ctx is not None:
+        return ctx
+    if sticky.is_sticky(token_str):
+        # недавний logout/обновление: реплика может ещё видеть старое состояние
+        use_primary(db)
+    loaded = _read_with_fallback(db, crud.get_auth_context, token_str)
+    if not loaded:
+        raise _invalid_token()
+    token_obj, user, role_ids, grants = loaded
+    expires_at = token_obj.expires_at
+    if settings.TOKEN_SLIDING_EXPIRY:
+        # продление могло ещё не дойти до БД — оно лежит в буфере до следующего flush
+        expires_at = max(expires_at, token_touches.pending_expiry(token_str) or expires_at)
+    if expires_at < datetime.utcnow():
+        # строку удалит фоновая чистка (app.maintenance), запрос ничего не пишет
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired.")
-    user = token_obj.user
-    if not user or not user.is_active:
+    if not user.is_active:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User inactive.")
-    return user
+    _remember(token_str, user, role_ids, grants, expires_at, token_obj.created_at)
+    return AuthContext(token_str, user, role_ids, grants, token=token_obj, token_key=token_str,
+                       issued_at=token_obj.created_at)
+
+
+def _load_auth_context(db: Session, token_str: str) -> AuthContext:
+    try:
+        if tokens.is_signed(token_str):
+            ctx = _load_signed_context(db, token_str)
+        else:
+            ctx = _load_opaque_context(db, token_str)
+        _touch(ctx)
+        return ctx
+    finally:
+        # большинство обработчиков дальше в БД не ходят — соединение не держим до конца ответа,
+        # в том числе после 401 и на пути подписанных токенов
+        release_connection(db)
+
+
+# стадия названа по get_current_user: вся работа аутентификации происходит здесь
+@timed("get_current_user")
+async def get_auth_context(request: Request, db: Session = Depends(get_db)) -> AuthContext:
+    # мемоизация на запрос: зависимости и обработчики делят один результат
+    ctx = getattr(request.state, "auth_context", None)
+    if ctx is None:
+        token_str = _token_from_header(request)
+        token_key = _token_key(token_str)
+        ctx = _context_from_memory(token_str, token_key)
+        if ctx is not None:
+            # попадание в L1: ни сессии, ни перехода в threadpool
+            _touch(ctx)
+        else:
+            if token_cache.backend is not None and is_async_session(db):
+                # run_sync идёт в потоке event loop и бэкенд там не читает — L2 и sticky-метку берём сейчас
+                await run_in_threadpool(_prefetch_shared, token_key)
+            ctx = await run_db(db, _load_auth_context, token_str)
+        request.state.auth_context = ctx
+    return ctx
+
+
+async def get_current_user(ctx: AuthContext = Depends(get_auth_context)) -> Any:
+    return ctx.user
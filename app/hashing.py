@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from fastapi import HTTPException, status
+
+from .config import settings
+from .instrumentation import timed
+
+
+@timed("hash_password")
+def hash_password(raw_password: str, rounds: int = None) -> str:
+    salt = bcrypt.gensalt(rounds=rounds or settings.BCRYPT_ROUNDS)
+    return bcrypt.hashpw(raw_password.encode('utf-8'), salt).decode('utf-8')
+
+
+@timed("check_password")
+def verify_password(raw_password: str, password_hash: str) -> bool:
+    try:
+        return bcrypt.checkpw(raw_password.encode('utf-8'), password_hash.encode('utf-8'))
+    except Exception:
+        return False
+
+
+def hash_rounds(password_hash: str):
+    # формат bcrypt: $2b$<cost>$<salt+hash>
+    try:
+        return int(password_hash.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def needs_rehash(password_hash: str) -> bool:
+    return hash_rounds(password_hash) != settings.BCRYPT_ROUNDS
+
+
+class HashPoolBusy(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail="Authentication service is busy, retry later.",
+                         headers={"Retry-After": "1"})
+
+
+class PasswordHasher:
+    """Отдельный пул для bcrypt, чтобы логины не занимали общий threadpool AnyIO.
+
+    bcrypt отпускает GIL на время хеширования, поэтому потоков достаточно.
+    Одновременно принимается не больше workers + queue_limit задач, остальные
+    сразу получают 503.
+    """
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashPoolBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, raw_password: str) -> str:
+        return await self._run(hash_password, raw_password)
+
+    async def verify(self, raw_password: str, password_hash: str) -> bool:
+        return await self._run(verify_password, raw_password, password_hash)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE_LIMIT)
@@ -0,0 +1,117 @@
+import contextvars
+import functools
+import inspect
+import time
+
+from sqlalchemy import event
+
+from .config import settings
+from .metrics import registry, Histogram
+
+enabled = settings.METRICS_ENABLED
+
+REQUEST_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route template.", ["method", "route", "status"],
+))
+REQUEST_DB_STATEMENTS = registry.register(Histogram(
+    "http_request_db_statements", "SQL statements executed per request.", ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+))
+REQUEST_DB_SECONDS = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent executing SQL per request.", ["method", "route"],
+))
+STAGE_SECONDS = registry.register(Histogram(
+    "auth_stage_duration_seconds", "Time spent in auth hot-path stages.", ["stage"],
+))
+
+# [statements, seconds] текущего запроса; run_in_threadpool и run_sync копируют контекст,
+# поэтому список виден и из потоков, выполняющих запросы к БД
+_db_stats = contextvars.ContextVar("db_stats", default=None)
+
+
+def current_db_stats():
+    return _db_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _db_stats.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+
+
+def instrument_engine(engine):
+    if not enabled:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def timed(stage: str):
+    """Декоратор: время вызова попадает в auth_stage_duration_seconds{stage}.
+
+    При выключенных метриках возвращает функцию как есть — накладных расходов нет.
+    """
+    def decorator(fn):
+        if not enabled:
+            return fn
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+        return wrapper
+
+    return decorator
+
+
+class MetricsMiddleware:
+    """ASGI middleware: латентность и SQL на запрос с меткой шаблона маршрута (/articles/{article_id}/update)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = [0, 0.0]
+        reset = _db_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _db_stats.reset(reset)
+            route = scope.get("route")
+            # неизвестные пути не размножают серии метрик
+            path = route.path_format if route is not None else "<unmatched>"
+            method = scope["method"]
+            REQUEST_LATENCY.observe(elapsed, method, path, status_code)
+            REQUEST_DB_STATEMENTS.observe(stats[0], method, path)
+            REQUEST_DB_SECONDS.observe(stats[1], method, path)
@@ -0,0 +1,96 @@
+import json
+import logging
+import uuid
+
+from .acl import acl_index
+from .cache import backend, token_cache, call_backend
+from .config import settings
+from . import tokens
+
+logger = logging.getLogger(__name__)
+
+
+class Invalidator:
+    """Применяет инвалидацию локально и рассылает её остальным воркерам через pub/sub."""
+
+    ACL_VERSION_KEY = "fastauth:acl:version"
+
+    def __init__(self, backend, token_cache, acl_index, revocations, channel: str, node_id: str = None):
+        self.backend = backend
+        self.token_cache = token_cache
+        self.acl_index = acl_index
+        self.revocations = revocations
+        self.channel = channel
+        self.node_id = node_id or uuid.uuid4().hex
+        if backend is not None:
+            acl_index.next_version = self._next_acl_version
+            acl_index.listeners.append(self.acl_changed)
+
+    def start(self):
+        if self.backend is not None:
+            self.backend.subscribe(self.channel, self.handle)
+
+    def stop(self):
+        if self.backend is not None:
+            self.backend.close()
+
+    def token_revoked(self, token_key: str, expires_at: float = None):
+        self.token_cache.invalidate_token(token_key)
+        if expires_at is not None:
+            self.revocations.deny(token_key, expires_at)
+        self._publish({"t": "token", "k": token_key, "exp": expires_at})
+
+    def user_revoked(self, user_id: str, not_before: float, until: float):
+        self.token_cache.invalidate_user(user_id)
+        self.revocations.revoke_user(user_id, not_before, until)
+        self._publish({"t": "user", "u": str(user_id), "nb": not_before, "until": until})
+
+    def user_changed(self, user_id: str):
+        self.token_cache.invalidate_user(user_id)
+        self._publish({"t": "user", "u": str(user_id)})
+
+    def acl_changed(self, version: int):
+        self._publish({"t": "acl", "v": version})
+
+    def handle(self, message: str):
+        try:
+            event = json.loads(message)
+        except ValueError:
+            logger.warning("Malformed invalidation message: %r", message)
+            return
+        if event.get("o") == self.node_id:
+            return
+        kind = event.get("t")
+        # L2 уже очищен отправителем — здесь трогаем только свой L1
+        if kind == "token":
+            self.token_cache.invalidate_token(event["k"], local_only=True)
+            if event.get("exp") is not None:
+                self.revocations.deny(event["k"], event["exp"])
+        elif kind == "user":
+            self.token_cache.invalidate_user(event["u"], local_only=True)
+            if event.get("nb") is not None:
+                self.revocations.revoke_user(event["u"], event["nb"], event["until"])
+        elif kind == "acl":
+            self.acl_index.invalidate(event.get("v"))
+
+    def _publish(self, event: dict):
+        if self.backend is None:
+            return
+        event["o"] = self.node_id
+        call_backend(self._send, event["t"], json.dumps(event))
+
+    def _send(self, kind: str, message: str):
+        try:
+            self.backend.publish(self.channel, message)
+        except Exception:
+            logger.warning("Failed to publish invalidation %s", kind, exc_info=True)
+
+    def _next_acl_version(self) -> int:
+        try:
+            return self.backend.incr(self.ACL_VERSION_KEY)
+        except Exception:
+            logger.warning("Shared ACL version unavailable, bumping locally", exc_info=True)
+            return self.acl_index.version + 1
+
+
+invalidator = Invalidator(backend, token_cache, acl_index, tokens.revocations, settings.CACHE_INVALIDATION_CHANNEL)
@@ -1,18 +1,81 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+
+from . import crud
+from .audit import audit_queue, flush_audit, enabled as audit_enabled
+from .database import engine, SessionFactory, run_db
+from .background import PeriodicWorker
+from .config import settings
+from .hashing import password_hasher
+from .invalidation import invalidator
+from .acl import acl_index
+from .maintenance import run_token_reaper, run_revocation_reload, run_acl_version_check
+from .instrumentation import MetricsMiddleware
+from .metrics import registry
+from .migrations import check_schema
+from .sliding import token_touches, flush_token_touches
+from .routers import auth, profile, admin_acl, mock_business, authz
+
 
-from .database import engine, Base
-from .routers import auth, profile, admin_acl, mock_business
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # схему меняет только `python -m app.migrations upgrade`; импорт приложения БД не трогает
+    await run_in_threadpool(check_schema, engine)
+    shared = settings.CACHE_BACKEND == "redis"
+    with SessionFactory() as db:
+        await run_db(db, crud.load_revocations)
+        if not shared:
+            await run_db(db, acl_index.sync_stored_version)
+    invalidator.start()
+    workers = []
+    if settings.TOKEN_REAPER_INTERVAL_SECONDS > 0:
+        workers.append(PeriodicWorker("token-reaper", settings.TOKEN_REAPER_INTERVAL_SECONDS, run_token_reaper))
+    if not shared and settings.ACL_VERSION_CHECK_INTERVAL_SECONDS > 0:
+        workers.append(PeriodicWorker("acl-version-check", settings.ACL_VERSION_CHECK_INTERVAL_SECONDS,
+                                      run_acl_version_check))
+    if settings.TOKEN_FORMAT == "signed" and not shared and settings.REVOCATION_RELOAD_INTERVAL_SECONDS > 0:
+        workers.append(PeriodicWorker("revocation-reload", settings.REVOCATION_RELOAD_INTERVAL_SECONDS,
+                                      run_revocation_reload))
+    if settings.TOKEN_SLIDING_EXPIRY:
+        flusher = PeriodicWorker("token-touch-flush", settings.TOKEN_TOUCH_FLUSH_INTERVAL_SECONDS,
+                                 flush_token_touches, run_on_stop=True)
+        token_touches.on_threshold = flusher.wake
+        workers.append(flusher)
+    if audit_enabled:
+        audit_writer = PeriodicWorker("audit-writer", settings.AUDIT_FLUSH_INTERVAL_SECONDS, flush_audit,
+                                      run_on_stop=True)
+        audit_queue.on_batch = audit_writer.wake
+        workers.append(audit_writer)
+    for worker in workers:
+        worker.start()
+    yield
+    for worker in workers:
+        # join потока и финальный flush не должны стоять в event loop
+        await run_in_threadpool(worker.stop)
+    invalidator.stop()
+    password_hasher.shutdown()
 
-Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="FastAuth - Custom Auth & ACL")
+app = FastAPI(title="FastAuth - Custom Auth & ACL", lifespan=lifespan)
+
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth.router)
 app.include_router(profile.router)
 app.include_router(admin_acl.router)
 app.include_router(mock_business.router)
+app.include_router(authz.router)
 
 
 @app.get("/")
 def root():
     return {"msg": "FastAuth - API up"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    return registry.render()
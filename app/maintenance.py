@@ -0,0 +1,93 @@
+import argparse
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import select, delete, or_, and_
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .acl import acl_index, bump_stored_version
+from .config import settings
+from .database import SessionFactory
+from .sliding import flush_token_touches
+
+logger = logging.getLogger(__name__)
+
+
+def _reapable():
+    now = datetime.utcnow()
+    return or_(
+        models.AuthToken.expires_at < now,
+        # отозванные подписанные токены нужны до истечения срока: по ним восстанавливается denylist
+        and_(models.AuthToken.is_active == False, models.AuthToken.jti.is_(None)),
+    )
+
+
+def reap_tokens(db: Session, batch_size: int = None, pause: float = None, max_batches: int = None) -> int:
+    """Удаляет истёкшие и отозванные токены пачками по batch_size, с паузой между пачками."""
+    batch_size = batch_size or settings.TOKEN_REAPER_BATCH_SIZE
+    pause = settings.TOKEN_REAPER_PAUSE_SECONDS if pause is None else pause
+    deleted = batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = db.execute(select(models.AuthToken.id).where(_reapable()).limit(batch_size)).scalars().all()
+        if not ids:
+            break
+        db.execute(delete(models.AuthToken).where(models.AuthToken.id.in_(ids)))
+        db.commit()
+        deleted += len(ids)
+        batches += 1
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    if deleted:
+        logger.info("Reaped %s auth tokens in %s batches", deleted, batches)
+    return deleted
+
+
+def run_token_reaper():
+    if settings.TOKEN_SLIDING_EXPIRY:
+        # иначе удалится токен, чьё продление ещё лежит в буфере этого воркера
+        flush_token_touches()
+    with SessionFactory() as db:
+        reap_tokens(db)
+
+
+def run_acl_version_check():
+    # пересборку ACL на другом воркере без pub/sub видно только по acl_state
+    with SessionFactory() as db:
+        acl_index.sync_stored_version(db)
+
+
+def run_revocation_reload():
+    # без общего pub/sub отзывы из других воркеров видны только в auth_tokens
+    with SessionFactory() as db:
+        crud.load_revocations(db)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    reap = sub.add_parser("reap-tokens", help="delete expired and revoked auth tokens")
+    reap.add_argument("--batch-size", type=int, default=settings.TOKEN_REAPER_BATCH_SIZE)
+    reap.add_argument("--pause", type=float, default=settings.TOKEN_REAPER_PAUSE_SECONDS)
+    reap.add_argument("--max-batches", type=int, default=None)
+    sub.add_parser("rebuild-acl", help="recompute role_closure and effective_permissions from scratch")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "reap-tokens":
+        with SessionFactory() as db:
+            deleted = reap_tokens(db, args.batch_size, args.pause, args.max_batches)
+        print(f"deleted {deleted} tokens")
+    elif args.command == "rebuild-acl":
+        with SessionFactory() as db:
+            roles = crud.rebuild_role_closure(db)
+            # работающие воркеры пересоберут свои снимки при следующей сверке версии
+            bump_stored_version(db)
+        print(f"rebuilt effective permissions for {roles} roles")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Исходная схема: таблицы, которые раньше создавал create_all при импорте app.main.
+
+Определения заморожены здесь, а не берутся из models: модели будут меняться,
+а эта миграция должна создавать ровно ту схему, что была в версии 1.
+checkfirst=True позволяет принять под управление базы, созданные ещё create_all.
+"""
+from sqlalchemy import (MetaData, Table, Column, String, Boolean, DateTime, ForeignKey, Integer,
+                        UniqueConstraint)
+from sqlalchemy.dialects.postgresql import UUID
+
+metadata = MetaData()
+
+Table(
+    "users", metadata,
+    Column("id", UUID(as_uuid=False), primary_key=True),
+    Column("email", String(255), unique=True, nullable=False, index=True),
+    Column("password_hash", String(128), nullable=False),
+    Column("first_name", String(150), nullable=True),
+    Column("last_name", String(150), nullable=True),
+    Column("middle_name", String(150), nullable=True),
+    Column("is_active", Boolean, nullable=False),
+    Column("is_staff", Boolean, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+Table(
+    "auth_tokens", metadata,
+    Column("id", UUID(as_uuid=False), primary_key=True),
+    Column("user_id", UUID(as_uuid=False), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True),
+    Column("token", String(128), unique=True, nullable=False, index=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("expires_at", DateTime, nullable=False),
+    Column("is_active", Boolean, nullable=False),
+)
+
+Table(
+    "roles", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("name", String(50), unique=True, nullable=False),
+    Column("description", String(255), nullable=True),
+)
+
+Table(
+    "resources", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("name", String(100), unique=True, nullable=False),
+    Column("description", String(255), nullable=True),
+)
+
+Table(
+    "permissions", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("action", String(30), nullable=False),
+    Column("description", String(255), nullable=True),
+    UniqueConstraint("action", name="uq_permission_action"),
+)
+
+Table(
+    "role_permissions", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("role_id", Integer, ForeignKey("roles.id", ondelete="CASCADE"), nullable=False),
+    Column("resource_id", Integer, ForeignKey("resources.id", ondelete="CASCADE"), nullable=False),
+    Column("permission_id", Integer, ForeignKey("permissions.id", ondelete="CASCADE"), nullable=False),
+    UniqueConstraint("role_id", "resource_id", "permission_id", name="uq_role_resource_perm"),
+)
+
+Table(
+    "user_roles", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("user_id", UUID(as_uuid=False), ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+    Column("role_id", Integer, ForeignKey("roles.id", ondelete="CASCADE"), nullable=False),
+    UniqueConstraint("user_id", "role_id", name="uq_user_role"),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
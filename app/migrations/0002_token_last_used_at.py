@@ -0,0 +1,7 @@
+"""auth_tokens.last_used_at — для скользящего срока действия токенов."""
+from sqlalchemy import DateTime, text
+
+
+def upgrade(conn):
+    column_type = DateTime().compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE auth_tokens ADD COLUMN last_used_at {column_type}"))
@@ -0,0 +1,54 @@
+"""Наследование ролей и wildcard-права.
+
+role_parents — рёбра "роль наследует права родителя"; role_closure — все пары
+(предок, потомок), поддерживаются при изменении рёбер; effective_permissions —
+свои и унаследованные права роли одной плоской таблицей. Wildcard — обычные
+строки resources.name = "*" и permissions.action = "*".
+"""
+from sqlalchemy import MetaData, Table, Column, Integer, ForeignKey, Index, select, insert
+
+metadata = MetaData()
+
+roles = Table("roles", metadata, Column("id", Integer, primary_key=True))
+resources = Table("resources", metadata, Column("id", Integer, primary_key=True), Column("name"))
+permissions = Table("permissions", metadata, Column("id", Integer, primary_key=True), Column("action"))
+role_permissions = Table(
+    "role_permissions", metadata,
+    Column("role_id", Integer), Column("resource_id", Integer), Column("permission_id", Integer),
+)
+
+new_tables = [
+    Table(
+        "role_parents", metadata,
+        Column("role_id", Integer, ForeignKey("roles.id", ondelete="CASCADE"), primary_key=True),
+        Column("parent_role_id", Integer, ForeignKey("roles.id", ondelete="CASCADE"), primary_key=True),
+    ),
+    Table(
+        "role_closure", metadata,
+        Column("ancestor_id", Integer, ForeignKey("roles.id", ondelete="CASCADE"), primary_key=True),
+        Column("descendant_id", Integer, ForeignKey("roles.id", ondelete="CASCADE"), primary_key=True),
+        Index("ix_role_closure_descendant", "descendant_id"),
+    ),
+    Table(
+        "effective_permissions", metadata,
+        Column("role_id", Integer, ForeignKey("roles.id", ondelete="CASCADE"), primary_key=True),
+        Column("resource_id", Integer, ForeignKey("resources.id", ondelete="CASCADE"), primary_key=True),
+        Column("permission_id", Integer, ForeignKey("permissions.id", ondelete="CASCADE"), primary_key=True),
+    ),
+]
+
+
+def upgrade(conn):
+    for table in new_tables:
+        table.create(conn)
+    if conn.execute(select(resources.c.id).where(resources.c.name == "*")).first() is None:
+        conn.execute(insert(resources).values(name="*"))
+    if conn.execute(select(permissions.c.id).where(permissions.c.action == "*")).first() is None:
+        conn.execute(insert(permissions).values(action="*"))
+    # наследования ещё нет: эффективные права совпадают с выданными напрямую
+    effective = new_tables[2]
+    conn.execute(insert(effective).from_select(
+        ["role_id", "resource_id", "permission_id"],
+        select(role_permissions.c.role_id, role_permissions.c.resource_id, role_permissions.c.permission_id)
+        .distinct(),
+    ))
@@ -0,0 +1,20 @@
+"""audit_events — журнал событий безопасности (login, logout, выдача ролей, удаление аккаунта)."""
+from sqlalchemy import MetaData, Table, Column, Integer, BigInteger, String, DateTime, JSON, Index
+
+metadata = MetaData()
+
+audit_events = Table(
+    "audit_events", metadata,
+    Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("event", String(50), nullable=False),
+    Column("user_id", String(36), nullable=True),
+    Column("ip", String(45), nullable=True),
+    Column("data", JSON, nullable=True),
+    Index("ix_audit_events_created_at", "created_at"),
+    Index("ix_audit_events_user_created", "user_id", "created_at"),
+)
+
+
+def upgrade(conn):
+    audit_events.create(conn)
@@ -0,0 +1,9 @@
+"""Индекс user_roles (role_id, id) — выборка назначений роли с seek-пагинацией без скана таблицы."""
+from sqlalchemy import MetaData, Table, Column, Integer, Index
+
+metadata = MetaData()
+user_roles = Table("user_roles", metadata, Column("id", Integer, primary_key=True), Column("role_id", Integer))
+
+
+def upgrade(conn):
+    Index("ix_user_roles_role_id", user_roles.c.role_id, user_roles.c.id).create(conn)
@@ -0,0 +1,109 @@
+"""auth_tokens: sha256-дайджест вместо открытого токена, частичный индекс по активным токенам.
+
+token (String(128), unique + отдельный индекс) заменяется на token_digest — 32 байта
+sha256 от ключа токена (opaque-токен или "jti:<id>"). Для подписанных токенов jti
+хранится отдельно: по нему восстанавливается denylist, он не даёт доступа без подписи.
+
+Индексы: уникальный частичный (token_digest) WHERE is_active — поиск токена при
+аутентификации, отозванные строки в него не попадают; (user_id, is_active) — массовый
+отзыв и лимит сессий вместо индекса только по user_id.
+
+PostgreSQL (11+): изменение на месте, дайджест считается в SQL одним UPDATE.
+Остальные СУБД (SQLite не умеет DROP COLUMN у уникальной колонки): таблица
+пересоздаётся, строки копируются пачками.
+"""
+import hashlib
+
+from sqlalchemy import (MetaData, Table, Column, String, Boolean, DateTime, ForeignKey, LargeBinary, select,
+                        insert, text)
+from sqlalchemy.dialects.postgresql import UUID
+
+BATCH = 5000
+
+metadata = MetaData()
+
+users = Table("users", metadata, Column("id", UUID(as_uuid=False), primary_key=True))
+
+old_tokens = Table(
+    "auth_tokens", metadata,
+    Column("id", UUID(as_uuid=False), primary_key=True),
+    Column("user_id", UUID(as_uuid=False)),
+    Column("token", String(128)),
+    Column("created_at", DateTime),
+    Column("expires_at", DateTime),
+    Column("is_active", Boolean),
+    Column("last_used_at", DateTime),
+)
+
+new_tokens = Table(
+    "auth_tokens_new", metadata,
+    Column("id", UUID(as_uuid=False), primary_key=True),
+    Column("user_id", UUID(as_uuid=False), ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+    Column("token_digest", LargeBinary(32), nullable=False),
+    Column("jti", String(64), nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("expires_at", DateTime, nullable=False),
+    Column("is_active", Boolean, nullable=False),
+    Column("last_used_at", DateTime, nullable=True),
+)
+
+JTI_PREFIX = "jti:"
+
+
+def _create_indexes(conn):
+    # условие индекса повторяет то, как SQLAlchemy рендерит is_active == True: иначе SQLite его не применит
+    active = "is_active" if conn.dialect.name == "postgresql" else "is_active = 1"
+    conn.execute(text(f"CREATE UNIQUE INDEX ux_auth_tokens_active_digest ON auth_tokens (token_digest) "
+                      f"WHERE {active}"))
+    conn.execute(text("CREATE INDEX ix_auth_tokens_user_active ON auth_tokens (user_id, is_active)"))
+
+
+def _upgrade_postgresql(conn):
+    conn.execute(text("ALTER TABLE auth_tokens ADD COLUMN token_digest BYTEA, ADD COLUMN jti VARCHAR(64)"))
+    conn.execute(text(
+        "UPDATE auth_tokens SET token_digest = sha256(convert_to(token, 'UTF8')), "
+        f"jti = CASE WHEN token LIKE '{JTI_PREFIX}%' THEN substr(token, {len(JTI_PREFIX) + 1}) END"
+    ))
+    conn.execute(text("ALTER TABLE auth_tokens ALTER COLUMN token_digest SET NOT NULL"))
+    # вместе с колонкой уходят её уникальный индекс и ix_auth_tokens_token
+    conn.execute(text("ALTER TABLE auth_tokens DROP COLUMN token"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_auth_tokens_user_id"))
+    _create_indexes(conn)
+
+
+def _copy_row(row) -> dict:
+    token = row.token
+    return {
+        "id": row.id,
+        "user_id": row.user_id,
+        "token_digest": hashlib.sha256(token.encode("utf-8")).digest(),
+        "jti": token[len(JTI_PREFIX):] if token.startswith(JTI_PREFIX) else None,
+        "created_at": row.created_at,
+        "expires_at": row.expires_at,
+        "is_active": row.is_active,
+        "last_used_at": row.last_used_at,
+    }
+
+
+def _upgrade_rebuild(conn):
+    new_tokens.create(conn)
+    last_id = None
+    while True:
+        q = select(old_tokens).order_by(old_tokens.c.id).limit(BATCH)
+        if last_id is not None:
+            q = q.where(old_tokens.c.id > last_id)
+        rows = conn.execute(q).all()
+        if not rows:
+            break
+        conn.execute(insert(new_tokens), [_copy_row(r) for r in rows])
+        last_id = rows[-1].id
+    conn.execute(text("DROP TABLE auth_tokens"))
+    conn.execute(text("ALTER TABLE auth_tokens_new RENAME TO auth_tokens"))
+    _create_indexes(conn)
+
+
+def upgrade(conn):
+    if conn.dialect.name == "postgresql":
+        _upgrade_postgresql(conn)
+    else:
+        _upgrade_rebuild(conn)
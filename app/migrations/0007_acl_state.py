@@ -0,0 +1,18 @@
+"""acl_state — версия ACL в БД: по ней воркеры без общего pub/sub узнают о пересборке на другом воркере."""
+from datetime import datetime
+
+from sqlalchemy import MetaData, Table, Column, Integer, BigInteger, DateTime, insert
+
+metadata = MetaData()
+
+acl_state = Table(
+    "acl_state", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("version", BigInteger, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+
+def upgrade(conn):
+    acl_state.create(conn)
+    conn.execute(insert(acl_state).values(id=1, version=0, updated_at=datetime.utcnow()))
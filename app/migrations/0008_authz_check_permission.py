@@ -0,0 +1,20 @@
+"""Ресурс "authz" и действие "check" для POST /authz/check.
+
+Без них выдать право authz:check было нечем, и эндпоинт отвечал 403 всем, кроме is_staff.
+Само право выдаётся роли сервиса через /admin/role-permissions.
+"""
+from sqlalchemy import MetaData, Table, Column, Integer, String, select, insert
+
+metadata = MetaData()
+
+resources = Table("resources", metadata, Column("id", Integer, primary_key=True), Column("name", String(100)),
+                  Column("description", String(255)))
+permissions = Table("permissions", metadata, Column("id", Integer, primary_key=True), Column("action", String(30)),
+                    Column("description", String(255)))
+
+
+def upgrade(conn):
+    if conn.execute(select(resources.c.id).where(resources.c.name == "authz")).first() is None:
+        conn.execute(insert(resources).values(name="authz", description="Пакетная проверка прав"))
+    if conn.execute(select(permissions.c.id).where(permissions.c.action == "check")).first() is None:
+        conn.execute(insert(permissions).values(action="check", description="Проверка прав"))
@@ -0,0 +1,97 @@
+"""Версионированные миграции схемы.
+
+Каждая миграция — модуль NNNN_name.py в этом пакете с функцией upgrade(conn).
+Применённые версии записываются в schema_version. Запуск — один раз на деплой:
+
+    python -m app.migrations upgrade
+
+Воркеры при старте только сверяют версию (check_schema), схему не трогают.
+Любое изменение моделей сопровождается новой миграцией.
+"""
+import importlib
+import logging
+import pkgutil
+import re
+from datetime import datetime
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, select, insert, inspect, text
+
+logger = logging.getLogger(__name__)
+
+_NAME = re.compile(r"^(\d{4})_\w+$")
+
+_metadata = MetaData()
+schema_version = Table(
+    "schema_version", _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+def discover() -> list:
+    """[(version, name)] по возрастанию версии."""
+    found = []
+    for info in pkgutil.iter_modules(__path__):
+        m = _NAME.match(info.name)
+        if m:
+            found.append((int(m.group(1)), info.name))
+    found.sort()
+    versions = [v for v, _ in found]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f"Duplicate migration versions: {versions}")
+    return found
+
+
+def head() -> int:
+    found = discover()
+    return found[-1][0] if found else 0
+
+
+def current_version(conn) -> int:
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    return conn.execute(select(schema_version.c.version).order_by(schema_version.c.version.desc())
+                        .limit(1)).scalar() or 0
+
+
+def _lock(conn):
+    # два одновременных деплоя не должны применять одну миграцию дважды
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('fastauth_schema'))"))
+
+
+def upgrade(engine, target: int = None) -> list:
+    """Применяет недостающие миграции, каждую в своей транзакции. Возвращает применённые версии."""
+    applied = []
+    for version, name in discover():
+        if target is not None and version > target:
+            break
+        with engine.begin() as conn:
+            _lock(conn)
+            _metadata.create_all(conn, checkfirst=True)
+            if version <= current_version(conn):
+                continue
+            logger.info("Applying migration %s", name)
+            importlib.import_module(f"{__name__}.{name}").upgrade(conn)
+            conn.execute(insert(schema_version).values(version=version, name=name, applied_at=datetime.utcnow()))
+            applied.append(version)
+    return applied
+
+
+def check_schema(engine):
+    """Пара лёгких запросов на старте воркера вместо create_all с отражением всех таблиц."""
+    expected = head()
+    with engine.connect() as conn:
+        current = current_version(conn)
+    if current < expected:
+        raise SchemaOutOfDate(f"Database schema is at version {current}, code expects {expected}; "
+                              f"run `python -m app.migrations upgrade`")
+    if current > expected:
+        # миграции накатываются до выкладки кода: старые воркеры должны продолжать стартовать
+        logger.warning("Database schema version %s is newer than code (%s)", current, expected)
+    return current
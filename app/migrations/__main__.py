@@ -0,0 +1,29 @@
+import argparse
+import logging
+
+from ..database import engine
+from . import upgrade, current_version, head, check_schema
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.migrations")
+    sub = parser.add_subparsers(dest="command", required=True)
+    up = sub.add_parser("upgrade", help="apply pending migrations")
+    up.add_argument("--target", type=int, default=None, help="stop at this version")
+    sub.add_parser("current", help="show the applied and the latest available version")
+    sub.add_parser("check", help="exit non-zero if the database is behind the code")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "upgrade":
+        applied = upgrade(engine, args.target)
+        print(f"applied {applied}" if applied else "schema is up to date")
+    elif args.command == "current":
+        with engine.connect() as conn:
+            print(f"current {current_version(conn)}, head {head()}")
+    elif args.command == "check":
+        check_schema(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,13 @@
 import uuid
 from datetime import datetime
 
-import bcrypt
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Integer, UniqueConstraint
+from sqlalchemy import (Column, String, Boolean, DateTime, ForeignKey, Integer, BigInteger, JSON, LargeBinary,
+                        UniqueConstraint, Index, text)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 
 from .database import Base
+from .hashing import hash_password, verify_password
 
 
 def generate_uuid():
@@ -30,30 +31,35 @@ class User(Base):
     roles = relationship("UserRole", back_populates="user", cascade="all, delete-orphan")
 
     def set_password(self, raw_password: str):
-        pw = bcrypt.hashpw(raw_password.encode('utf-8'), bcrypt.gensalt())
-        self.password_hash = pw.decode('utf-8')
+        self.password_hash = hash_password(raw_password)
 
     def check_password(self, raw_password: str) -> bool:
-        try:
-            return bcrypt.checkpw(raw_password.encode('utf-8'), self.password_hash.encode('utf-8'))
-        except Exception:
-            return False
+        return verify_password(raw_password, self.password_hash)
 
     def soft_delete(self):
         self.is_active = False
 
 
 class AuthToken(Base):
+    """Строка токена; сам токен не хранится — только sha256 от его ключа (tokens.digest)."""
     __tablename__ = "auth_tokens"
     id = Column(UUID(as_uuid=False), primary_key=True, default=generate_uuid)
-    user_id = Column(UUID(as_uuid=False), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
-    token = Column(String(128), unique=True, nullable=False, index=True)
+    user_id = Column(UUID(as_uuid=False), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    token_digest = Column(LargeBinary(32), nullable=False)
+    jti = Column(String(64), nullable=True)  # только у подписанных токенов: нужен denylist после рестарта
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     expires_at = Column(DateTime, nullable=False)
     is_active = Column(Boolean, default=True, nullable=False)
+    last_used_at = Column(DateTime, nullable=True)
 
     user = relationship("User", back_populates="tokens")
 
+    __table_args__ = (
+        Index("ux_auth_tokens_active_digest", "token_digest", unique=True,
+              postgresql_where=text("is_active"), sqlite_where=text("is_active = 1")),
+        Index("ix_auth_tokens_user_active", "user_id", "is_active"),
+    )
+
     def revoke(self):
         self.is_active = False
 
@@ -104,4 +110,63 @@ class UserRole(Base):
     user = relationship("User", back_populates="roles")
     role = relationship("Role", back_populates="user_roles")
 
-    __table_args__ = (UniqueConstraint('user_id', 'role_id', name='uq_user_role'),)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'role_id', name='uq_user_role'),
+        # фильтр по роли с seek-пагинацией по id в списке /admin/user-roles
+        Index("ix_user_roles_role_id", "role_id", "id"),
+    )
+
+
+class RoleParent(Base):
+    """Роль role_id наследует все права parent_role_id (и его предков)."""
+    __tablename__ = "role_parents"
+    role_id = Column(Integer, ForeignKey("roles.id", ondelete="CASCADE"), primary_key=True)
+    parent_role_id = Column(Integer, ForeignKey("roles.id", ondelete="CASCADE"), primary_key=True)
+
+
+class RoleClosure(Base):
+    """Транзитивное замыкание role_parents: все пары (предок, потомок), без пар роли с собой."""
+    __tablename__ = "role_closure"
+    ancestor_id = Column(Integer, ForeignKey("roles.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("roles.id", ondelete="CASCADE"), primary_key=True)
+
+    __table_args__ = (Index("ix_role_closure_descendant", "descendant_id"),)
+
+
+class EffectivePermission(Base):
+    """Свои и унаследованные права роли; wildcard хранится как ресурс/действие "*"."""
+    __tablename__ = "effective_permissions"
+    role_id = Column(Integer, ForeignKey("roles.id", ondelete="CASCADE"), primary_key=True)
+    resource_id = Column(Integer, ForeignKey("resources.id", ondelete="CASCADE"), primary_key=True)
+    permission_id = Column(Integer, ForeignKey("permissions.id", ondelete="CASCADE"), primary_key=True)
+
+
+class AuditEvent(Base):
+    """Журнал событий безопасности; пишется пачками из app.audit.
+
+    user_id без внешнего ключа: запись переживает пользователя и не требует проверки FK при вставке.
+    """
+    __tablename__ = "audit_events"
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, nullable=False)
+    event = Column(String(50), nullable=False)
+    user_id = Column(String(36), nullable=True)
+    ip = Column(String(45), nullable=True)
+    data = Column(JSON(none_as_null=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_audit_events_created_at", "created_at"),
+        Index("ix_audit_events_user_created", "user_id", "created_at"),
+    )
+
+
+class ACLState(Base):
+    """Одна строка: версия ACL, общая для всех воркеров.
+
+    Каждая пересборка ACL увеличивает version; воркеры без общего CACHE_BACKEND сверяют
+    её периодически и пересобирают свой снимок, если отстали.
+    """
+    __tablename__ = "acl_state"
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -1,18 +1,16 @@
 from fastapi import HTTPException, status, Depends
-from . import crud
-from sqlalchemy.orm import Session
-from .deps import get_db, get_current_user
+from .deps import AuthContext, get_auth_context
+from .instrumentation import timed
 
 
 def require_permission(resource_name: str, action: str):
-    def dependency(user=Depends(get_current_user), db: Session = Depends(get_db)):
-        if getattr(user, "is_staff", False):
+    @timed("require_permission")
+    async def dependency(ctx: AuthContext = Depends(get_auth_context)):
+        if getattr(ctx.user, "is_staff", False):
             return True
-        role_ids = crud.get_user_role_ids(db, user.id)
-        if not role_ids:
+        if not ctx.role_ids:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden.")
-        allowed = crud.check_role_permission(db, role_ids, resource_name, action)
-        if not allowed:
+        if not ctx.has_permission(resource_name, action):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden.")
         return True
 
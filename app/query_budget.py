@@ -0,0 +1,88 @@
+import contextvars
+import logging
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+mode = settings.QUERY_BUDGET_MODE
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class Budget:
+    def __init__(self, route: str, limit: int):
+        self.route = route
+        self.limit = limit
+        self.statements = 0
+        self.lazy_loads = 0
+        self.reported = False
+
+
+# аутентификация: один запрос (токен + пользователь + права) и до трёх на пересборку ACL-индекса
+AUTH_QUERIES = 4
+
+_budget = contextvars.ContextVar("query_budget", default=None)
+
+
+def _violation(message: str):
+    if mode == "strict":
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    budget = _budget.get()
+    if budget is None:
+        return
+    budget.statements += 1
+    if budget.statements > budget.limit and not budget.reported:
+        # в режиме log предупреждаем один раз на запрос
+        budget.reported = True
+        _violation(f"{budget.route}: query budget of {budget.limit} exceeded by: {statement}")
+
+
+def _on_orm_execute(orm_execute_state):
+    if not orm_execute_state.is_relationship_load:
+        return
+    # lazy_loaded_from есть только у ленивой загрузки; selectinload и т.п. не считаются
+    state = orm_execute_state.lazy_loaded_from
+    if state is None:
+        return
+    budget = _budget.get()
+    if budget is not None:
+        budget.lazy_loads += 1
+    route = budget.route if budget is not None else "-"
+    _violation(f"{route}: lazy load from {state.class_.__name__}; load the relationship explicitly")
+
+
+def install(engine):
+    if mode == "off":
+        return
+    event.listen(engine, "before_cursor_execute", _on_execute)
+
+
+def install_session_hooks():
+    if mode == "off":
+        return
+    # на классе Session: покрывает и синхронные сессии, и sync_session у AsyncSession
+    event.listen(Session, "do_orm_execute", _on_orm_execute)
+
+
+def query_budget(max_statements: int):
+    """Зависимость маршрута: не больше max_statements SQL-запросов за запрос.
+
+    Подключать через dependencies=[...] декоратора маршрута — такие зависимости
+    разрешаются первыми, поэтому в бюджет попадает и аутентификация.
+    """
+    async def dependency(request: Request):
+        if mode != "off":
+            _budget.set(Budget(f"{request.method} {request.url.path}", max_statements))
+
+    return dependency
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
+
+from .cache import backend
+from .config import settings
+from .metrics import registry, Counter
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITED = registry.register(Counter("auth_rate_limited_total", "Login/register attempts rejected with 429.",
+                                         ["endpoint", "scope"]))
+
+
+class RateLimited(HTTPException):
+    def __init__(self, retry_after: float):
+        super().__init__(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many attempts, retry later.",
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class TokenBucketLimiter:
+    """Token bucket на ключ: burst попыток сразу, дальше rate в секунду.
+
+    Бакеты лежат в OrderedDict с LRU-вытеснением сверх maxsize. Бакет, который успел
+    наполниться полностью, ничем не отличается от отсутствующего, поэтому такие
+    записи удаляются при обращении и при вытеснении ничего не теряется.
+    """
+
+    def __init__(self, rate: float, burst: int, maxsize: int):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 and self.burst > 0
+
+    def acquire(self, key: str):
+        """Возвращает 0, если попытка разрешена, иначе — через сколько секунд повторить."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._buckets.pop(key, None)
+            tokens = self.burst
+            if item is not None:
+                tokens = min(self.burst, item[0] + (now - item[1]) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            tokens -= 1
+            if tokens < self.burst:
+                self._buckets[key] = (tokens, now)
+                while len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            return 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SharedWindowLimiter:
+    """Вариант для нескольких воркеров: фиксированное окно burst/rate секунд в общем бэкенде.
+
+    Пропускает burst попыток за окно — та же средняя скорость, что у token bucket,
+    но на один INCR на попытку. При недоступности бэкенда попытка пропускается.
+    """
+
+    PREFIX = "fastauth:rl:"
+
+    def __init__(self, backend, name: str, rate: float, burst: int):
+        self.backend = backend
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.window = burst / rate if rate > 0 else 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 and self.burst > 0
+
+    def acquire(self, key: str):
+        now = time.time()
+        window_id = int(now // self.window)
+        try:
+            count = self.backend.incr(f"{self.PREFIX}{self.name}:{key}:{window_id}", self.window)
+        except Exception:
+            logger.warning("Rate limit backend call failed", exc_info=True)
+            return 0
+        if count <= self.burst:
+            return 0
+        return (window_id + 1) * self.window - now
+
+
+def _make_limiter(name: str, rate_per_minute: float, burst: int):
+    rate = rate_per_minute / 60
+    if settings.RATE_LIMIT_SHARED and backend is not None:
+        return SharedWindowLimiter(backend, name, rate, burst)
+    return TokenBucketLimiter(rate, burst, settings.RATE_LIMIT_MAX_KEYS)
+
+
+def _email_key(email: str) -> str:
+    # в ключи (в том числе в Redis) не попадает сам адрес
+    return hashlib.sha256(email.strip().lower().encode("utf-8")).hexdigest()[:32]
+
+
+class AuthRateLimiter:
+    def __init__(self):
+        self.by_ip = _make_limiter("ip", settings.RATE_LIMIT_IP_PER_MINUTE, settings.RATE_LIMIT_IP_BURST)
+        self.by_email = _make_limiter("email", settings.RATE_LIMIT_EMAIL_PER_MINUTE, settings.RATE_LIMIT_EMAIL_BURST)
+        self.shared = isinstance(self.by_ip, SharedWindowLimiter) or isinstance(self.by_email, SharedWindowLimiter)
+
+    async def check(self, endpoint: str, request: Request, email: str):
+        """Вызывается первым в обработчике: до обращения к БД и bcrypt.
+
+        Общий лимитер делает INCR в бэкенде — такая проверка идёт в threadpool;
+        token bucket в памяти считается прямо в event loop.
+        """
+        if self.shared:
+            await run_in_threadpool(self._check, endpoint, request, email)
+        else:
+            self._check(endpoint, request, email)
+
+    def _check(self, endpoint: str, request: Request, email: str):
+        if self.by_ip.enabled and request.client is not None:
+            retry_after = self.by_ip.acquire(request.client.host)
+            if retry_after:
+                RATE_LIMITED.inc(1, endpoint, "ip")
+                raise RateLimited(retry_after)
+        if self.by_email.enabled:
+            retry_after = self.by_email.acquire(_email_key(email))
+            if retry_after:
+                RATE_LIMITED.inc(1, endpoint, "email")
+                raise RateLimited(retry_after)
+
+
+auth_rate_limiter = AuthRateLimiter()
@@ -0,0 +1,153 @@
+import itertools
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from .cache import TTLCache, backend, in_loop_session
+from . import tokens
+from .config import settings
+from .metrics import registry, GaugeCallback
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaSet:
+    """Реплики для чтения: round-robin, упавшая реплика пропускается REPLICA_RETRY_SECONDS."""
+
+    def __init__(self, engines: list, retry_after: float):
+        self.engines = engines
+        self.retry_after = retry_after
+        self._down_until = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        for e in engines:
+            event.listen(e, "handle_error", self._on_error)
+
+    def __bool__(self):
+        return bool(self.engines)
+
+    def choose(self):
+        """Следующая живая реплика или None — тогда читаем с primary."""
+        now = time.monotonic()
+        start = next(self._counter)
+        for i in range(len(self.engines)):
+            engine = self.engines[(start + i) % len(self.engines)]
+            if self._down_until.get(engine, 0) <= now:
+                return engine
+        return None
+
+    def mark_down(self, engine):
+        with self._lock:
+            self._down_until[engine] = time.monotonic() + self.retry_after
+        logger.warning("Replica %s marked down for %ss", engine.url.render_as_string(hide_password=True),
+                       self.retry_after)
+
+    def _on_error(self, context):
+        # ошибки соединения (в том числе при connect) выводят реплику из ротации
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+    def health(self) -> dict:
+        now = time.monotonic()
+        return {(e.pool.logging_name or f"replica{i}",): int(self._down_until.get(e, 0) <= now)
+                for i, e in enumerate(self.engines)}
+
+
+def routing_session_class(primary, replicas: ReplicaSet):
+    """Session, отправляющая SELECT на реплики, а запись — на primary.
+
+    После первой записи (или use_primary) сессия до конца читает с primary,
+    чтобы запрос видел собственные изменения.
+    """
+
+    class RoutingSession(Session):
+        def get_bind(self, mapper=None, *, clause=None, **kw):
+            if self._flushing or (clause is not None and not clause.is_select):
+                self.info["use_primary"] = True
+                return primary
+            if (replicas and not self.info.get("use_primary") and clause is not None
+                    and getattr(clause, "_for_update_arg", None) is None):
+                replica = replicas.choose()
+                if replica is not None:
+                    return replica
+            return primary
+
+    return RoutingSession
+
+
+def use_primary(db):
+    """Все следующие запросы этой сессии (sync или AsyncSession) идут на primary."""
+    getattr(db, "sync_session", db).info["use_primary"] = True
+
+
+class ReadYourWrites:
+    """Метки "читать с primary" для токенов, по которым только что была запись.
+
+    Живут STICKY_PRIMARY_SECONDS — дольше типичного лага реплики; при общем
+    CACHE_BACKEND видны всем воркерам.
+    """
+
+    PREFIX = "fastauth:sticky:"
+
+    def __init__(self, ttl: float, backend, enabled: bool):
+        self.ttl = ttl
+        self.backend = backend
+        self.enabled = enabled
+        self._local = TTLCache(settings.TOKEN_CACHE_SIZE or 10000, ttl)
+
+    def _remote(self, key: str) -> str:
+        return self.PREFIX + tokens.digest(key).hex()
+
+    async def mark(self, key: str):
+        if not self.enabled:
+            return
+        self._local.set(key, True)
+        if self.backend is not None:
+            # сетевой SET — в threadpool: метка должна дойти до ответа, но не ценой event loop
+            await run_in_threadpool(self._mark_remote, key)
+
+    def _mark_remote(self, key: str):
+        try:
+            self.backend.set(self._remote(key), "1", self.ttl)
+        except Exception:
+            logger.warning("Sticky mark for replica routing failed", exc_info=True)
+
+    def is_sticky(self, key: str) -> bool:
+        """Внутри run_sync у AsyncSession — только локальные метки; общую deps читает заранее в threadpool."""
+        if not self.enabled:
+            return False
+        if self._local.get(key):
+            return True
+        if self.backend is None or in_loop_session():
+            return False
+        try:
+            found = self.backend.get(self._remote(key)) is not None
+        except Exception:
+            return False
+        if found:
+            self._local.set(key, True)
+        return found
+
+
+sticky = ReadYourWrites(settings.STICKY_PRIMARY_SECONDS, backend, enabled=bool(settings.DATABASE_REPLICA_URLS))
+
+
+_replica_sets = []
+
+
+def register_health_metric(replicas: ReplicaSet):
+    _replica_sets.append(replicas)
+
+
+def _health():
+    values = {}
+    for replicas in _replica_sets:
+        values.update(replicas.health())
+    return values
+
+
+registry.register(GaugeCallback("db_replica_up", "1 if the replica is in rotation.", ["pool"], _health))
@@ -1,46 +1,254 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from ..deps import get_db, get_current_user
-from .. import crud
-from ..schemas import RoleCreate, RoleOut, ResourceCreate, PermissionCreate, RolePermissionCreate, UserRoleAssign
+from starlette.concurrency import run_in_threadpool
+from ..deps import get_db, get_current_user, db_session
+from .. import crud_async, audit
+from ..database import run_db
+from ..schemas import (RoleCreate, RoleOut, ResourceCreate, PermissionCreate, RolePermissionCreate, UserRoleAssign,
+                       RoleParentCreate)
 from ..models import User
+from ..cache import token_cache
+from ..acl import acl_index
+from ..config import settings
+from ..utils import iso, json_response_class
+
+router = APIRouter(prefix="/admin", tags=["admin"], default_response_class=json_response_class())
+
 
-router = APIRouter(prefix="/admin", tags=["admin"])
+async def _rebuild_acl(db: Session):
+    version = None
+    if acl_index.next_version is not None:
+        # INCR общего счётчика в Redis: внутри run_sync он шёл бы в потоке event loop
+        version = await run_in_threadpool(acl_index.next_version)
+    return await run_db(db, acl_index.rebuild, version)
 
 
-def ensure_admin(user: User = Depends(get_current_user)):
+async def ensure_admin(user: User = Depends(get_current_user)):
     if not user.is_staff:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required.")
     return user
 
 
 @router.post("/roles", response_model=RoleOut)
-def create_role(payload: RoleCreate, db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
-    r = crud.create_role(db, name=payload.name, description=payload.description)
+async def create_role(payload: RoleCreate, db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
+    r = await crud_async.create_role(db, name=payload.name, description=payload.description)
+    await _rebuild_acl(db)
     return RoleOut(id=r.id, name=r.name, description=r.description)
 
 
 @router.post("/resources")
-def create_resource(payload: ResourceCreate, db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
-    res = crud.create_resource(db, name=payload.name, description=payload.description)
+async def create_resource(payload: ResourceCreate, db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
+    res = await crud_async.create_resource(db, name=payload.name, description=payload.description)
+    await _rebuild_acl(db)
     return {"id": res.id, "name": res.name}
 
 
 @router.post("/permissions")
-def create_permission(payload: PermissionCreate, db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
-    p = crud.create_permission(db, action=payload.action, description=payload.description)
+async def create_permission(payload: PermissionCreate, db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
+    p = await crud_async.create_permission(db, action=payload.action, description=payload.description)
+    await _rebuild_acl(db)
     return {"id": p.id, "action": p.action}
 
 
 @router.post("/role-permissions")
-def create_role_permission(payload: RolePermissionCreate, db: Session = Depends(get_db),
-                           _: User = Depends(ensure_admin)):
-    rp = crud.create_role_permission(db, role_id=payload.role_id, resource_id=payload.resource_id,
-                                     permission_id=payload.permission_id)
+async def create_role_permission(payload: RolePermissionCreate, db: Session = Depends(get_db),
+                                 _: User = Depends(ensure_admin)):
+    rp = await crud_async.create_role_permission(db, role_id=payload.role_id, resource_id=payload.resource_id,
+                                                 permission_id=payload.permission_id)
+    await _rebuild_acl(db)
     return {"id": rp.id}
 
 
 @router.post("/assign-role")
-def assign_role(payload: UserRoleAssign, db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
-    ur = crud.assign_role_to_user(db, user_id=payload.user_id, role_id=payload.role_id)
+async def assign_role(payload: UserRoleAssign, request: Request, db: Session = Depends(get_db),
+                      admin: User = Depends(ensure_admin)):
+    # user_roles в скомпилированный ACL не входит: кеш пользователя сбрасывает invalidator.user_changed в crud
+    ur = await crud_async.assign_role_to_user(db, user_id=payload.user_id, role_id=payload.role_id)
+    await audit.emit(audit.ROLE_ASSIGNED, admin.id, request, target_user_id=payload.user_id, role_id=payload.role_id)
     return {"id": ur.id}
+
+
+@router.post("/role-parents")
+async def add_role_parent(payload: RoleParentCreate, db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
+    """role_id наследует права parent_role_id и всех его предков."""
+    try:
+        await crud_async.add_role_parent(db, role_id=payload.role_id, parent_role_id=payload.parent_role_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    await _rebuild_acl(db)
+    return {"role_id": payload.role_id, "parent_role_id": payload.parent_role_id}
+
+
+@router.delete("/role-parents/{role_id}/{parent_role_id}")
+async def remove_role_parent(role_id: int, parent_role_id: int, db: Session = Depends(get_db),
+                             _: User = Depends(ensure_admin)):
+    if not await crud_async.remove_role_parent(db, role_id=role_id, parent_role_id=parent_role_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Role inheritance not found.")
+    await _rebuild_acl(db)
+    return {"detail": "removed"}
+
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonlines")
+
+
+def _too_large(detail: str):
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail)
+
+
+async def _read_body(request: Request) -> bytes:
+    """Тело целиком, но не больше ADMIN_BATCH_MAX_BYTES: чтение обрывается, как только предел превышен."""
+    body, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > settings.ADMIN_BATCH_MAX_BYTES:
+            raise _too_large(f"Batch body exceeds {settings.ADMIN_BATCH_MAX_BYTES} bytes.")
+        body.append(chunk)
+    return b"".join(body)
+
+
+async def _read_batch(request: Request) -> list:
+    """Тело batch-запроса: JSON-массив или NDJSON-поток (по строке на элемент)."""
+    body = await _read_body(request)
+    if request.headers.get("content-type", "").split(";")[0].strip() in NDJSON_TYPES:
+        lines = [line for line in body.split(b"\n") if line.strip()]
+        if len(lines) > settings.ADMIN_BATCH_MAX_ITEMS:
+            raise _too_large(f"Batch exceeds {settings.ADMIN_BATCH_MAX_ITEMS} items.")
+        try:
+            return [json.loads(line) for line in lines]
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Malformed NDJSON body.")
+    try:
+        items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Malformed JSON body.")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a JSON array.")
+    if len(items) > settings.ADMIN_BATCH_MAX_ITEMS:
+        raise _too_large(f"Batch exceeds {settings.ADMIN_BATCH_MAX_ITEMS} items.")
+    return items
+
+
+async def _run_batch(request: Request, db: Session, schema, bulk_fn, rebuild_acl: bool = True,
+                     on_created=None) -> dict:
+    """on_created(item, result) — корутина, ждётся для каждой созданной строки (например, аудит)."""
+    raw = await _read_batch(request)
+    valid, results = [], [None] * len(raw)
+    for i, item in enumerate(raw):
+        try:
+            valid.append((i, schema.parse_obj(item).dict()))
+        except ValidationError as e:
+            results[i] = {"index": i, "status": "error", "detail": e.errors()}
+    if valid:
+        for (i, item), res in zip(valid, await bulk_fn(db, [item for _, item in valid])):
+            results[i] = dict(res, index=i)
+            if on_created is not None and res["status"] == "created":
+                await on_created(item, res)
+        if rebuild_acl:
+            # одна пересборка ACL на весь batch
+            await _rebuild_acl(db)
+    summary = {}
+    for r in results:
+        summary[r["status"]] = summary.get(r["status"], 0) + 1
+    return {"summary": summary, "results": results}
+
+
+@router.post("/roles/batch")
+async def create_roles_batch(request: Request, db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
+    return await _run_batch(request, db, RoleCreate, crud_async.bulk_create_roles)
+
+
+@router.post("/resources/batch")
+async def create_resources_batch(request: Request, db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
+    return await _run_batch(request, db, ResourceCreate, crud_async.bulk_create_resources)
+
+
+@router.post("/permissions/batch")
+async def create_permissions_batch(request: Request, db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
+    return await _run_batch(request, db, PermissionCreate, crud_async.bulk_create_permissions)
+
+
+@router.post("/role-permissions/batch")
+async def create_role_permissions_batch(request: Request, db: Session = Depends(get_db),
+                                        _: User = Depends(ensure_admin)):
+    return await _run_batch(request, db, RolePermissionCreate, crud_async.bulk_create_role_permissions)
+
+
+@router.post("/assign-role/batch")
+async def assign_roles_batch(request: Request, db: Session = Depends(get_db), admin: User = Depends(ensure_admin)):
+    async def audited(item, res):
+        await audit.emit(audit.ROLE_ASSIGNED, admin.id, request, target_user_id=item["user_id"],
+                         role_id=item["role_id"], user_role_id=res["id"])
+
+    # как и /assign-role: ACL не пересобирается, кеши пользователей сбрасывает crud.bulk_assign_roles
+    return await _run_batch(request, db, UserRoleAssign, crud_async.bulk_assign_roles, rebuild_acl=False,
+                            on_created=audited)
+
+
+@router.get("/cache-stats")
+async def cache_stats(_: User = Depends(ensure_admin)):
+    return {"token_cache": token_cache.stats(), "acl_version": acl_index.version}
+
+
+PAGE_LIMIT = Query(100, ge=1, le=1000)
+FORMAT = Query("json", regex="^(json|ndjson)$")
+EXPORT_CHUNK = 1000
+
+
+async def _ndjson_rows(list_fn, after, filters: dict):
+    """Выгрузка пачками по EXPORT_CHUNK той же seek-пагинацией; в памяти не больше одной пачки."""
+    async with db_session() as db:
+        while True:
+            rows = await list_fn(db, after, EXPORT_CHUNK, **filters)
+            await crud_async.end_read(db)
+            if rows:
+                yield "".join(json.dumps(r, default=iso) + "\n" for r in rows)
+            if len(rows) < EXPORT_CHUNK:
+                return
+            after = rows[-1]["id"]
+
+
+async def _list(db: Session, list_fn, after, limit: int, format: str, **filters):
+    """Страница {"items", "next_after"} или, при format=ndjson, поток всех строк начиная с after."""
+    if format == "ndjson":
+        return StreamingResponse(_ndjson_rows(list_fn, after, filters), media_type="application/x-ndjson")
+    items = await list_fn(db, after, limit, **filters)
+    return {"items": items, "next_after": items[-1]["id"] if len(items) == limit else None}
+
+
+@router.get("/users")
+async def list_users(after: Optional[str] = None, limit: int = PAGE_LIMIT, format: str = FORMAT,
+                     is_active: Optional[bool] = None, role_id: Optional[int] = None,
+                     db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
+    return await _list(db, crud_async.list_users, after, limit, format, is_active=is_active, role_id=role_id)
+
+
+@router.get("/roles")
+async def list_roles(after: Optional[int] = None, limit: int = PAGE_LIMIT, format: str = FORMAT,
+                     db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
+    return await _list(db, crud_async.list_roles, after, limit, format)
+
+
+@router.get("/role-permissions")
+async def list_role_permissions(after: Optional[int] = None, limit: int = PAGE_LIMIT, format: str = FORMAT,
+                                role_id: Optional[int] = None, db: Session = Depends(get_db),
+                                _: User = Depends(ensure_admin)):
+    return await _list(db, crud_async.list_role_permissions, after, limit, format, role_id=role_id)
+
+
+@router.get("/user-roles")
+async def list_user_roles(after: Optional[int] = None, limit: int = PAGE_LIMIT, format: str = FORMAT,
+                          user_id: Optional[str] = None, role_id: Optional[int] = None,
+                          db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
+    return await _list(db, crud_async.list_user_roles, after, limit, format, user_id=user_id, role_id=role_id)
+
+
+@router.get("/tokens")
+async def list_tokens(after: Optional[str] = None, limit: int = PAGE_LIMIT, format: str = FORMAT,
+                      user_id: Optional[str] = None, active_only: bool = False,
+                      db: Session = Depends(get_db), _: User = Depends(ensure_admin)):
+    return await _list(db, crud_async.list_tokens, after, limit, format, user_id=user_id, active_only=active_only)
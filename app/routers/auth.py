@@ -1,44 +1,64 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
-from .. import schemas, crud
-from ..deps import get_db, get_current_user
+from .. import schemas, crud_async, tokens, audit
+from ..config import settings
+from ..deps import AuthContext, get_db, get_auth_context
+from ..hashing import password_hasher, needs_rehash
+from ..query_budget import query_budget, AUTH_QUERIES
+from ..ratelimit import auth_rate_limiter
+from ..replicas import sticky, use_primary
 from ..schemas import RegisterIn, LoginIn, TokenOut
-from ..models import User
-from ..utils import iso
+from ..utils import iso, json_response_class
 
-router = APIRouter(prefix="/auth", tags=["auth"])
+router = APIRouter(prefix="/auth", tags=["auth"], default_response_class=json_response_class())
 
 
-@router.post("/register", status_code=201)
-def register(payload: RegisterIn, db: Session = Depends(get_db)):
+@router.post("/register", status_code=201, dependencies=[Depends(query_budget(3))])
+async def register(payload: RegisterIn, request: Request, db: Session = Depends(get_db)):
+    await auth_rate_limiter.check("register", request, payload.email)
+    use_primary(db)
     if payload.password != payload.password2:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Passwords do not match.")
-    if crud.get_user_by_email(db, payload.email):
+    if await crud_async.get_user_by_email(db, payload.email):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered.")
-    user = crud.create_user(db, email=payload.email, password=payload.password,
-                            first_name=payload.first_name, last_name=payload.last_name, middle_name=payload.middle_name)
+    password_hash = await password_hasher.hash(payload.password)
+    user = await crud_async.create_user(db, email=payload.email, password_hash=password_hash,
+                                        first_name=payload.first_name, last_name=payload.last_name,
+                                        middle_name=payload.middle_name)
     return {"id": user.id, "email": user.email}
 
 
-@router.post("/login", response_model=TokenOut)
-def login(payload: LoginIn, db: Session = Depends(get_db)):
-    u = crud.get_user_by_email(db, payload.email)
-    if not u or not u.check_password(payload.password):
+# пользователь, INSERT токена, при смене стоимости bcrypt — UPDATE хеша, при MAX_SESSIONS_PER_USER — отзыв старых
+@router.post("/login", response_model=TokenOut, dependencies=[Depends(query_budget(4))])
+async def login(payload: LoginIn, request: Request, db: Session = Depends(get_db)):
+    # отказ по лимиту ничего не стоит: ни запроса к БД, ни bcrypt
+    await auth_rate_limiter.check("login", request, payload.email)
+    # пользователь мог только что зарегистрироваться — реплика его ещё не видит
+    use_primary(db)
+    u = await crud_async.get_user_by_email(db, payload.email)
+    if not u or not await password_hasher.verify(payload.password, u.password_hash):
+        # адрес не пишем: по журналу не должно быть видно, какие email существуют
+        await audit.emit(audit.LOGIN_FAILED, u.id if u else None, request)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials.")
     if not u.is_active:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Account inactive.")
-    token_obj = crud.create_token_for_user(db, u)
-    return TokenOut(token=token_obj.token, expires_at=token_obj.expires_at)
+    if needs_rehash(u.password_hash):
+        # сохранится тем же commit, что и новый токен
+        u.password_hash = await password_hasher.hash(payload.password)
+    signed = settings.TOKEN_FORMAT == "signed"
+    token_obj, token_key = await crud_async.create_token_for_user(db, u, signed=signed)
+    await sticky.mark(token_key)
+    await audit.emit(audit.LOGIN, u.id, request)
+    token_str = tokens.issue(token_obj) if signed else token_key
+    return TokenOut(token=token_str, expires_at=token_obj.expires_at)
 
 
-@router.post("/logout")
-def logout(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    auth = request.headers.get("Authorization")
-    token_str = auth[len("Token "):].strip() if auth and auth.startswith("Token ") else None
-    if not token_str:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token required.")
-    token_obj = crud.get_token(db, token_str)
+@router.post("/logout", dependencies=[Depends(query_budget(AUTH_QUERIES + 2))])
+async def logout(request: Request, db: Session = Depends(get_db), ctx: AuthContext = Depends(get_auth_context)):
+    token_obj = ctx.token or await crud_async.get_token(db, ctx.token_key)
     if not token_obj:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token.")
-    crud.revoke_token(db, token_obj)
+    await crud_async.revoke_token(db, token_obj, ctx.token_key)
+    await sticky.mark(ctx.token_key)
+    await audit.emit(audit.LOGOUT, token_obj.user_id, request)
     return {"detail": "logged out"}
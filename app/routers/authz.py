@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from ..deps import get_db
+from ..permissions import require_permission
+from ..schemas import AuthzCheckIn, AuthzCheckOut
+from .. import crud_async
+from ..utils import json_response_class
+
+router = APIRouter(prefix="/authz", tags=["authz"], default_response_class=json_response_class())
+
+
+@router.post("/check", response_model=AuthzCheckOut)
+async def check(payload: AuthzCheckIn, db: Session = Depends(get_db), _=Depends(require_permission("authz", "check"))):
+    decisions = await crud_async.check_permissions_batch(
+        db, [(c.user_id, c.token, c.resource, c.action) for c in payload.checks])
+    return AuthzCheckOut(decisions=decisions)
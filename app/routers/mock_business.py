@@ -1,11 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app.deps import get_db, get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from app import audit
+from app.deps import AuthContext, get_auth_context, get_current_user
 from app.permissions import require_permission
-from app import crud  # используем crud, чтобы показать реальные обращения к БД (роль пользователя)
-import logging
-
-logger = logging.getLogger(__name__)
+from app.query_budget import query_budget, AUTH_QUERIES
 
 router = APIRouter(prefix="/articles", tags=["business"])
 
@@ -16,9 +13,9 @@ _fake_articles = [
 ]
 
 
-@router.get("/")
-def list_articles(
-    db: Session = Depends(get_db),
+@router.get("/", dependencies=[Depends(query_budget(AUTH_QUERIES))])
+async def list_articles(
+    ctx: AuthContext = Depends(get_auth_context),
     current_user=Depends(get_current_user),
     perm=Depends(require_permission("article", "read")),
 ):
@@ -27,17 +24,11 @@ def list_articles(
     Требуется право: article:read
 
     Параметры-зависимости используются явно:
-    - db: для получения списка ролей пользователя (демонстрация использования)
+    - ctx: контекст аутентификации (роли уже загружены вместе с токеном, повторного запроса нет)
     - current_user: id пользователя включён в метаданные ответа
     - perm: результат зависимости (обычно True) — проверка уже выполнена
     """
-    # Используем db + crud, чтобы показать, какие роли у пользователя:
-    try:
-        role_ids = crud.get_user_role_ids(db, current_user.id) or []
-    except Exception as e:
-        # если что-то пошло не так с БД — логируем и возвращаем 500
-        logger.exception("Failed to fetch user roles: %s", e)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal error")
+    role_ids = ctx.role_ids
 
     # Формируем ответ: статьи + метаданные (показываем, что зависимости реально используются)
     return {
@@ -49,10 +40,11 @@ def list_articles(
     }
 
 
-@router.post("/{article_id}/update")
-def update_article(
+@router.post("/{article_id}/update", dependencies=[Depends(query_budget(AUTH_QUERIES))])
+async def update_article(
     article_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    ctx: AuthContext = Depends(get_auth_context),
     current_user=Depends(get_current_user),
     perm=Depends(require_permission("article", "update")),
 ):
@@ -60,9 +52,9 @@ def update_article(
     Mock-обновление статьи.
     Требуется право: article:update
 
-    В теле явно используем db/current_user/perm:
+    В теле явно используем ctx/current_user/perm:
     - проверяем наличия статьи,
-    - логируем кто выполнил обновление,
+    - фиксируем в журнале аудита, кто выполнил обновление,
     - возвращаем информацию о пользователе и изменении.
     """
     # проверка существования "статьи" в мок-списке
@@ -70,11 +62,11 @@ def update_article(
     if not article:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Article not found")
 
-    # демонстрация использования db: получить роли пользователя (для логирования)
-    role_ids = crud.get_user_role_ids(db, current_user.id) or []
+    # роли берём из контекста запроса (для логирования)
+    role_ids = ctx.role_ids
 
-    # логируем фактическое действие (в реальном приложении здесь бы было обновление в БД)
-    logger.info("User %s (roles=%s) updated article %s", current_user.email, role_ids, article_id)
+    # фиксируем фактическое действие в журнале аудита (в реальном приложении здесь бы было обновление в БД)
+    await audit.emit(audit.ARTICLE_UPDATED, current_user.id, request, article_id=article_id, role_ids=role_ids)
 
     return {
         "detail": f"Article {article_id} updated (mock).",
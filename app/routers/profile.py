@@ -1,51 +1,61 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Request, Response, status
 from sqlalchemy.orm import Session
-from ..deps import get_db, get_current_user
-from ..schemas import ProfileOut
+from ..deps import AuthContext, get_db, get_current_user, get_auth_context
+from ..schemas import ProfileOut, ProfileUpdate
 from ..models import User
-from .. import crud
-
-router = APIRouter(prefix="/auth", tags=["profile"])
-
-
-@router.get("/profile", response_model=ProfileOut)
-def get_profile(user: User = Depends(get_current_user)):
-    return ProfileOut(
-        id=user.id,
-        email=user.email,
-        first_name=user.first_name,
-        last_name=user.last_name,
-        middle_name=user.middle_name,
-        is_active=user.is_active,
-    )
-
-
-@router.patch("/profile", response_model=ProfileOut)
-def update_profile(payload: dict, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    allowed = {"first_name", "last_name", "middle_name"}
-    changed = False
-    for k, v in payload.items():
-        if k in allowed:
-            setattr(user, k, v)
-            changed = True
-    if changed:
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    return ProfileOut(
-        id=user.id,
-        email=user.email,
-        first_name=user.first_name,
-        last_name=user.last_name,
-        middle_name=user.middle_name,
-        is_active=user.is_active,
-    )
-
-
-@router.delete("/profile")
-def delete_profile(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    user.soft_delete()
-    db.add(user)
-    db.commit()
-    crud.revoke_all_tokens_for_user(db, user)
+from ..query_budget import query_budget, AUTH_QUERIES
+from ..replicas import sticky
+from ..utils import json_response_class, etag, http_date, not_modified
+from .. import crud_async, audit
+
+response_class = json_response_class()
+
+router = APIRouter(prefix="/auth", tags=["profile"], default_response_class=response_class)
+
+
+def _profile(user: User) -> dict:
+    return {
+        "id": user.id,
+        "email": user.email,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "middle_name": user.middle_name,
+        "is_active": user.is_active,
+    }
+
+
+def _validators(user: User) -> dict:
+    return {
+        "ETag": etag(user.id, user.updated_at.isoformat()),
+        "Last-Modified": http_date(user.updated_at),
+        # ответ зависит от токена; клиент обязан перепроверять, но может слать If-None-Match
+        "Cache-Control": "private, no-cache",
+        "Vary": "Authorization",
+    }
+
+
+@router.get("/profile", response_model=ProfileOut, dependencies=[Depends(query_budget(AUTH_QUERIES))])
+async def get_profile(request: Request, user: User = Depends(get_current_user)):
+    headers = _validators(user)
+    if not_modified(request.headers, headers["ETag"], user.updated_at):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    # поля и так из модели: отдаём готовый ответ без повторной валидации через ProfileOut
+    return response_class(_profile(user), headers=headers)
+
+
+@router.patch("/profile", response_model=ProfileOut, dependencies=[Depends(query_budget(AUTH_QUERIES + 2))])
+async def update_profile(payload: ProfileUpdate, db: Session = Depends(get_db), user: User = Depends(get_current_user),
+                         ctx: AuthContext = Depends(get_auth_context)):
+    user = await crud_async.update_user_profile(db, user, payload.dict(exclude_unset=True))
+    # следующий GET должен увидеть изменения, а не снимок с реплики
+    await sticky.mark(ctx.token_key)
+    return response_class(_profile(user), headers=_validators(user))
+
+
+@router.delete("/profile", dependencies=[Depends(query_budget(AUTH_QUERIES + 3))])
+async def delete_profile(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user),
+                         ctx: AuthContext = Depends(get_auth_context)):
+    await crud_async.soft_delete_user(db, user)
+    await sticky.mark(ctx.token_key)
+    await audit.emit(audit.ACCOUNT_DELETED, user.id, request)
     return {"detail": "account soft-deleted"}
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, conlist, constr, root_validator
 from typing import Optional
 from datetime import datetime
 
@@ -31,6 +31,15 @@ class ProfileOut(BaseModel):
     is_active: bool
 
 
+class ProfileUpdate(BaseModel):
+    """Частичное обновление: меняются только переданные поля."""
+    first_name: Optional[constr(max_length=150)] = None
+    last_name: Optional[constr(max_length=150)] = None
+    middle_name: Optional[constr(max_length=150)] = None
+
+    class Config:
+        extra = "forbid"
+
 
 class RoleCreate(BaseModel):
     name: str
@@ -60,3 +69,29 @@ class RolePermissionCreate(BaseModel):
 class UserRoleAssign(BaseModel):
     user_id: str
     role_id: int
+
+
+class RoleParentCreate(BaseModel):
+    role_id: int
+    parent_role_id: int
+
+
+class AuthzCheck(BaseModel):
+    user_id: Optional[str] = None
+    token: Optional[str] = None
+    resource: str
+    action: str
+
+    @root_validator(skip_on_failure=True)
+    def one_subject(cls, values):
+        if bool(values.get("user_id")) == bool(values.get("token")):
+            raise ValueError("Exactly one of user_id or token is required.")
+        return values
+
+
+class AuthzCheckIn(BaseModel):
+    checks: conlist(AuthzCheck, min_items=1, max_items=1000)
+
+
+class AuthzCheckOut(BaseModel):
+    decisions: list[bool]
@@ -0,0 +1,68 @@
+import threading
+from datetime import datetime, timedelta
+
+from . import crud
+from .config import settings
+from .database import SessionFactory
+
+MAX_LIFETIME = timedelta(minutes=settings.TOKEN_MAX_LIFETIME_MINUTES)
+
+
+def extended_expiry(created_at: datetime, now: datetime) -> datetime:
+    return min(now + crud.TOKEN_LIFETIME, created_at + MAX_LIFETIME)
+
+
+class TouchBuffer:
+    """Последнее использование токенов, накопленное в памяти до следующего flush.
+
+    Повторные запросы с тем же токеном перезаписывают запись, поэтому в БД уходит
+    не больше одного UPDATE на токен за интервал, а не по записи на запрос.
+    """
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self.on_threshold = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def touch(self, token_key: str, created_at: datetime, now: datetime = None):
+        now = now or datetime.utcnow()
+        with self._lock:
+            self._pending[token_key] = (now, extended_expiry(created_at, now))
+            full = len(self._pending) >= self.threshold
+        if full and self.on_threshold is not None:
+            self.on_threshold()
+
+    def pending_expiry(self, token_key: str):
+        """Продлённый срок, ещё не записанный в БД, или None."""
+        item = self._pending.get(token_key)
+        return item[1] if item is not None else None
+
+    def drain(self) -> dict:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def restore(self, pending: dict):
+        # после неудачного flush возвращаем записи, которые не успели обновиться заново
+        with self._lock:
+            for key, value in pending.items():
+                self._pending.setdefault(key, value)
+
+    def __len__(self):
+        return len(self._pending)
+
+
+token_touches = TouchBuffer(settings.TOKEN_TOUCH_FLUSH_THRESHOLD)
+
+
+def flush_token_touches():
+    pending = token_touches.drain()
+    if not pending:
+        return
+    try:
+        with SessionFactory() as db:
+            crud.touch_tokens(db, pending)
+    except Exception:
+        token_touches.restore(pending)
+        raise
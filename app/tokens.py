@@ -0,0 +1,129 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from datetime import datetime
+
+from .config import settings
+
+SIGNED_PREFIX = "s1."
+# строки auth_tokens для подписанных токенов хранят jti с префиксом,
+# чтобы jti нельзя было предъявить как opaque-токен
+JTI_PREFIX = "jti:"
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def digest(token_key: str) -> bytes:
+    """Ключ строки auth_tokens: токены случайные (256 бит), соль не нужна."""
+    return hashlib.sha256(token_key.encode("utf-8")).digest()
+
+
+def timestamp(dt: datetime) -> float:
+    return (dt - _EPOCH).total_seconds()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _signing_keys() -> dict:
+    keys = dict(settings.PREVIOUS_SECRET_KEYS)
+    keys[settings.SECRET_KEY_ID] = settings.SECRET_KEY
+    return keys
+
+
+def _sign(key: str, message: str) -> str:
+    return _b64encode(hmac.new(key.encode("utf-8"), message.encode("ascii"), hashlib.sha256).digest())
+
+
+def is_signed(token_str: str) -> bool:
+    return token_str.startswith(SIGNED_PREFIX)
+
+
+def encode(claims: dict) -> str:
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    message = f"{SIGNED_PREFIX}{settings.SECRET_KEY_ID}.{payload}"
+    return f"{message}.{_sign(settings.SECRET_KEY, message)}"
+
+
+def decode(token_str: str):
+    """Проверяет подпись и срок действия; возвращает claims или None."""
+    try:
+        message, signature = token_str.rsplit(".", 1)
+        kid, payload = message[len(SIGNED_PREFIX):].split(".", 1)
+    except ValueError:
+        return None
+    key = _signing_keys().get(kid)
+    if key is None or not hmac.compare_digest(_sign(key, message), signature):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if claims.get("exp", 0) < time.time():
+        return None
+    return claims
+
+
+def issue(token_obj) -> str:
+    # права в токен не кладутся: они берутся из кеша или БД и меняются без перевыпуска
+    return encode({
+        "jti": token_obj.jti,
+        "sub": token_obj.user_id,
+        "iat": timestamp(token_obj.created_at),
+        "exp": timestamp(token_obj.expires_at),
+    })
+
+
+def new_jti() -> str:
+    return JTI_PREFIX + secrets.token_urlsafe(16)
+
+
+class RevocationList:
+    """Denylist по jti и "not-before" по пользователю; записи живут не дольше самих токенов."""
+
+    PRUNE_INTERVAL = 60
+
+    def __init__(self):
+        self._denied = {}
+        self._not_before = {}
+        self._lock = threading.Lock()
+        self._next_prune = time.monotonic() + self.PRUNE_INTERVAL
+
+    def deny(self, token_key: str, expires_at: float):
+        with self._lock:
+            self._denied[token_key] = expires_at
+            self._maybe_prune()
+
+    def revoke_user(self, user_id: str, not_before: float, until: float):
+        with self._lock:
+            self._not_before[str(user_id)] = (not_before, until)
+            self._maybe_prune()
+
+    def is_revoked(self, claims: dict) -> bool:
+        if JTI_PREFIX + claims["jti"] in self._denied:
+            return True
+        nb = self._not_before.get(claims["sub"])
+        return nb is not None and claims["iat"] <= nb[0]
+
+    def __len__(self):
+        return len(self._denied) + len(self._not_before)
+
+    def _maybe_prune(self):
+        if time.monotonic() < self._next_prune:
+            return
+        now = time.time()
+        self._denied = {k: exp for k, exp in self._denied.items() if exp > now}
+        self._not_before = {k: v for k, v in self._not_before.items() if v[1] > now}
+        self._next_prune = time.monotonic() + self.PRUNE_INTERVAL
+
+
+revocations = RevocationList()
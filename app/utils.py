@@ -1,5 +1,47 @@
-from datetime import datetime
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from .config import settings
 
 
 def iso(dt: datetime):
     return dt.isoformat()
+
+
+def json_response_class():
+    if not settings.ORJSON_RESPONSES:
+        return JSONResponse
+    import orjson  # noqa: F401 — без пакета падаем при старте, а не на первом запросе
+    return ORJSONResponse
+
+
+def etag(*parts) -> str:
+    digest = hashlib.sha1(":".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def http_date(dt: datetime) -> str:
+    # в БД время хранится в UTC без tzinfo
+    return format_datetime(dt.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def not_modified(headers, tag: str, last_modified: datetime) -> bool:
+    """If-None-Match важнее If-Modified-Since (RFC 9110, 13.2.2)."""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        # слабое сравнение: W/"x" и "x" совпадают
+        weak = tag.removeprefix("W/")
+        return if_none_match.strip() == "*" or weak in (t.strip().removeprefix("W/") for t in if_none_match.split(","))
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+    return False
@@ -0,0 +1,251 @@
+"""Нагрузочный прогон горячих путей auth/ACL.
+
+    python -m bench.run --database-url sqlite:///bench.db --users 2000 --requests 2000 --output bench.json
+
+База заполняется seed_data.seed_dataset, запросы идут в приложение внутри процесса
+(TestClient), поэтому измеряется стоимость самого приложения и БД без сети.
+Результат — JSON с p50/p95/p99, пропускной способностью, числом SQL на запрос
+(отдельно для первого запроса токена и из кеша) и временем холодного старта воркера
+(импорт app.main и lifespan).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.run")
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL", "sqlite:///bench.db"))
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--roles", type=int, default=10)
+    parser.add_argument("--resources", type=int, default=10)
+    parser.add_argument("--actions", type=int, default=4)
+    parser.add_argument("--tokens-per-user", type=int, default=3)
+    parser.add_argument("--sessions", type=int, default=50, help="users that log in; their tokens drive the load")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep-db", action="store_true", help="reuse an already seeded database")
+    parser.add_argument("--output", default="bench_results.json")
+    return parser.parse_args(argv)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    k = (len(ordered) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class StatementCounter:
+    """Считает SQL-запросы ко всем движкам приложения.
+
+    Запросы выполняются в потоках TestClient/threadpool, а не в потоке генератора,
+    поэтому счётчик общий; точное число на запрос даёт только последовательный прогон.
+    """
+
+    def __init__(self, *engines):
+        from sqlalchemy import event
+
+        self.count = 0
+        self._lock = threading.Lock()
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+
+
+def count_statements(client, counter, make_request, n):
+    statements = []
+    for i in range(n):
+        counter.reset()
+        make_request(client, i)
+        statements.append(counter.count)
+    return statements
+
+
+def sql_stats(statements, prefix: str) -> dict:
+    if not statements:
+        return {f"{prefix}_per_request": None, f"{prefix}_max": None}
+    return {f"{prefix}_per_request": round(statistics.fmean(statements), 3), f"{prefix}_max": max(statements)}
+
+
+def run_endpoint(client_factory, counter, make_request, n, concurrency, warmup, cold=0, reset=None):
+    """Возвращает метрики для n запросов; make_request(client, i) -> Response.
+
+    SQL считается дважды: sql_cold — первые cold запросов сразу после reset() (пустой кеш токенов,
+    по запросу на токен), sql_warm — после основного прогона, когда всё уже в кеше.
+    """
+    clients = [client_factory() for _ in range(concurrency)]
+    cold_statements = []
+    if cold:
+        reset()
+        cold_statements = count_statements(clients[0], counter, make_request, cold)
+    for i in range(warmup):
+        make_request(clients[0], i)
+
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def worker(wid):
+        nonlocal errors
+        client = clients[wid]
+        local_lat, local_err = [], 0
+        for i in range(wid, n, concurrency):
+            start = time.perf_counter()
+            r = make_request(client, i)
+            local_lat.append(time.perf_counter() - start)
+            if r.status_code >= 400:
+                local_err += 1
+        with lock:
+            latencies.extend(local_lat)
+            errors += local_err
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    warm_statements = count_statements(clients[0], counter, make_request, min(n, 100))
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        **sql_stats(cold_statements, "sql_cold"),
+        **sql_stats(warm_statements, "sql_warm"),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure_boot(runs: int = 3) -> dict:
+    """Холодный старт воркера: импорт app.main в чистом интерпретаторе и время lifespan."""
+    script = ("import time; t = time.perf_counter(); import app.main; t1 = time.perf_counter(); "
+              "from fastapi.testclient import TestClient; c = TestClient(app.main.app); c.__enter__(); "
+              "t2 = time.perf_counter(); c.__exit__(None, None, None); print(t1 - t, t2 - t1)")
+    imports, startups = [], []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, "-c", script], text=True, env=os.environ)
+        import_s, startup_s = map(float, out.split()[-2:])
+        imports.append(import_s)
+        startups.append(startup_s)
+    return {"import_ms": round(statistics.median(imports) * 1000, 1),
+            "startup_ms": round(statistics.median(startups) * 1000, 1), "runs": runs}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ["DATABASE_URL"] = args.database_url
+    # все запросы идут с одного адреса testclient — лимитер логина исказил бы замер
+    os.environ.setdefault("RATE_LIMIT_IP_PER_MINUTE", "0")
+    os.environ.setdefault("RATE_LIMIT_EMAIL_PER_MINUTE", "0")
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import MetaData
+    from sqlalchemy.engine import make_url
+
+    import seed_data
+    from app.config import settings
+    from app import migrations
+    from app.cache import token_cache
+    from app.database import engine, async_engine, SessionLocal
+    from app.main import app
+
+    if not args.keep_db:
+        existing = MetaData()
+        existing.reflect(bind=engine)
+        existing.drop_all(bind=engine)
+        migrations.upgrade(engine)
+        with SessionLocal() as db:
+            seed_started = time.perf_counter()
+            dataset = seed_data.seed_dataset(db, args.users, args.roles, args.resources, args.actions,
+                                             args.tokens_per_user, seed=args.seed)
+            print(f"seeded {len(dataset)} users in {time.perf_counter() - seed_started:.1f}s", file=sys.stderr)
+        emails = [u["email"] for u in dataset]
+    else:
+        emails = [f"bench{i}@example.com" for i in range(args.users)]
+
+    counter = StatementCounter(engine, *([async_engine.sync_engine] if async_engine else []))
+    rnd = random.Random(args.seed)
+    sample = rnd.sample(emails, min(args.sessions, len(emails)))
+    results = {}
+
+    with TestClient(app) as bootstrap:
+        def client_factory():
+            return TestClient(app)
+
+        def login(client, i):
+            return client.post("/auth/login", json={"email": sample[i % len(sample)], "password": "benchpass"})
+
+        # логин дорогой (bcrypt), поэтому прогоняем его по числу сессий; кеша у него нет — только sql_warm
+        results["POST /auth/login"] = run_endpoint(client_factory, counter, login, len(sample), args.concurrency,
+                                                   warmup=0)
+        tokens = [login(bootstrap, i).json()["token"] for i in range(len(sample))]
+        headers = [{"Authorization": f"Token {t}"} for t in tokens]
+
+        endpoints = {
+            "GET /auth/profile": lambda c, i: c.get("/auth/profile", headers=headers[i % len(headers)]),
+            "GET /articles/": lambda c, i: c.get("/articles/", headers=headers[i % len(headers)]),
+            "POST /articles/{id}/update": lambda c, i: c.post(f"/articles/{i % 2 + 1}/update",
+                                                             headers=headers[i % len(headers)]),
+        }
+        for name, fn in endpoints.items():
+            # холодный счёт — первый запрос каждого токена; токены логина уже лежат в кеше
+            results[name] = run_endpoint(client_factory, counter, fn, args.requests, args.concurrency, args.warmup,
+                                         cold=min(len(headers), args.requests), reset=token_cache.clear)
+
+    boot = measure_boot()
+    report = {
+        "boot": boot,
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "database": make_url(args.database_url).render_as_string(hide_password=True),
+            "db_async": settings.DB_ASYNC,
+            "token_format": settings.TOKEN_FORMAT,
+            "token_cache_size": settings.TOKEN_CACHE_SIZE,
+            "dataset": {"users": args.users, "roles": args.roles, "resources": args.resources,
+                        "actions": args.actions, "tokens_per_user": args.tokens_per_user},
+            "sessions": len(sample),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    json.dump({"boot": boot, **results}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,135 @@
-from app.database import SessionLocal, Base, engine
-from app import models, crud
+import argparse
+import random
+import secrets
+from datetime import datetime, timedelta
 
-Base.metadata.create_all(bind=engine)
+from sqlalchemy import insert, select
 
-db = SessionLocal()
+from app.database import SessionLocal, engine
+from app import models, crud, tokens
+from app.acl import WILDCARD
+from app.hashing import hash_password
+from app.migrations import upgrade
 
-admin_role = models.Role(name="admin", description="Администратор")
-editor_role = models.Role(name="editor", description="Может читать и создавать статьи")
-viewer_role = models.Role(name="viewer", description="Только чтение")
 
-db.add_all([admin_role, editor_role, viewer_role])
-db.commit()
+def seed_demo(db):
+    admin_role = models.Role(name="admin", description="Администратор")
+    editor_role = models.Role(name="editor", description="Может читать и создавать статьи")
+    viewer_role = models.Role(name="viewer", description="Только чтение")
 
-article_res = models.Resource(name="article", description="Статьи")
-db.add(article_res)
-db.commit()
+    db.add_all([admin_role, editor_role, viewer_role])
+    db.commit()
 
-perm_read = models.Permission(action="read", description="Чтение")
-perm_create = models.Permission(action="create", description="Создание")
-perm_update = models.Permission(action="update", description="Обновление")
-perm_delete = models.Permission(action="delete", description="Удаление")
-db.add_all([perm_read, perm_create, perm_update, perm_delete])
-db.commit()
+    article_res = models.Resource(name="article", description="Статьи")
+    db.add(article_res)
+    db.commit()
 
-db.add(models.RolePermission(role_id=admin_role.id, resource_id=article_res.id, permission_id=perm_read.id))
-db.add(models.RolePermission(role_id=admin_role.id, resource_id=article_res.id, permission_id=perm_create.id))
-db.add(models.RolePermission(role_id=admin_role.id, resource_id=article_res.id, permission_id=perm_update.id))
-db.add(models.RolePermission(role_id=admin_role.id, resource_id=article_res.id, permission_id=perm_delete.id))
+    perm_read = models.Permission(action="read", description="Чтение")
+    perm_create = models.Permission(action="create", description="Создание")
+    perm_update = models.Permission(action="update", description="Обновление")
+    perm_delete = models.Permission(action="delete", description="Удаление")
+    db.add_all([perm_read, perm_create, perm_update, perm_delete])
+    db.commit()
 
-db.add(models.RolePermission(role_id=editor_role.id, resource_id=article_res.id, permission_id=perm_read.id))
-db.add(models.RolePermission(role_id=editor_role.id, resource_id=article_res.id, permission_id=perm_create.id))
+    # admin наследует editor, editor наследует viewer: права не дублируются по ролям
+    crud.create_role_permission(db, viewer_role.id, article_res.id, perm_read.id)
+    crud.create_role_permission(db, editor_role.id, article_res.id, perm_create.id)
+    wildcard = db.execute(select(models.Permission.id).where(models.Permission.action == WILDCARD)).scalar_one()
+    crud.create_role_permission(db, admin_role.id, article_res.id, wildcard)  # article:*
+    crud.add_role_parent(db, editor_role.id, viewer_role.id)
+    crud.add_role_parent(db, admin_role.id, editor_role.id)
 
-db.add(models.RolePermission(role_id=viewer_role.id, resource_id=article_res.id, permission_id=perm_read.id))
+    admin_user = crud.create_user(db, email="admin@example.com", password="adminpass", first_name="Admin",
+                                  last_name="Root")
+    admin_user.is_staff = True
+    db.add(admin_user)
+    db.commit()
+    db.refresh(admin_user)
 
-db.commit()
+    db.add(models.UserRole(user_id=admin_user.id, role_id=admin_role.id))
+    db.commit()
 
-admin_user = crud.create_user(db, email="admin@example.com", password="adminpass", first_name="Admin", last_name="Root")
-admin_user.is_staff = True
-db.add(admin_user)
-db.commit()
-db.refresh(admin_user)
 
-db.add(models.UserRole(user_id=admin_user.id, role_id=admin_role.id))
-db.commit()
+def _bulk(db, model, rows, chunk=1000):
+    for i in range(0, len(rows), chunk):
+        db.execute(insert(model), rows[i:i + chunk])
+
+
+def seed_dataset(db, users: int, roles: int, resources: int, actions: int, tokens_per_user: int,
+                 password: str = "benchpass", seed: int = 42) -> list[dict]:
+    """Синтетический набор для нагрузочных тестов.
+
+    Все пользователи получают роль "bench" с правами article:read/update и ещё
+    до двух случайных ролей. Пароль у всех один — bcrypt считается один раз.
+    Возвращает [{"id", "email", "tokens"}] для генератора нагрузки.
+    """
+    rnd = random.Random(seed)
+    now = datetime.utcnow()
+
+    resource_names = ["article"] + [f"resource_{i}" for i in range(1, resources)]
+    action_names = ["read", "update"] + [f"action_{i}" for i in range(2, actions)]
+    _bulk(db, models.Resource, [{"name": n} for n in resource_names])
+    _bulk(db, models.Permission, [{"action": a} for a in action_names])
+    _bulk(db, models.Role, [{"name": "bench"}] + [{"name": f"role_{i}"} for i in range(1, roles)])
+    db.flush()
+    res_ids = dict(db.execute(select(models.Resource.name, models.Resource.id)
+                              .where(models.Resource.name != WILDCARD)).all())
+    perm_ids = dict(db.execute(select(models.Permission.action, models.Permission.id)
+                               .where(models.Permission.action != WILDCARD)).all())
+    role_ids = dict(db.execute(select(models.Role.name, models.Role.id)).all())
+    bench_role = role_ids.pop("bench")
+
+    grants = {(bench_role, res_ids["article"], perm_ids["read"]), (bench_role, res_ids["article"], perm_ids["update"])}
+    pairs = [(r, p) for r in res_ids.values() for p in perm_ids.values()]
+    for role_id in role_ids.values():
+        for res_id, perm_id in rnd.sample(pairs, min(len(pairs), max(1, len(pairs) // 4))):
+            grants.add((role_id, res_id, perm_id))
+    grant_rows = [{"role_id": r, "resource_id": res, "permission_id": p} for r, res, p in grants]
+    _bulk(db, models.RolePermission, grant_rows)
+    _bulk(db, models.EffectivePermission, grant_rows)
+
+    password_hash = hash_password(password)
+    dataset, user_rows, user_role_rows, token_rows = [], [], [], []
+    for i in range(users):
+        user_id = models.generate_uuid()
+        email = f"bench{i}@example.com"
+        user_rows.append({"id": user_id, "email": email, "password_hash": password_hash, "first_name": f"User{i}",
+                          "is_active": True, "is_staff": False, "created_at": now, "updated_at": now})
+        extra = rnd.sample(list(role_ids.values()), min(len(role_ids), rnd.randint(0, 2)))
+        user_role_rows.extend({"user_id": user_id, "role_id": r} for r in [bench_role] + extra)
+        user_tokens = [secrets.token_urlsafe(32) for _ in range(tokens_per_user)]
+        token_rows.extend({"id": models.generate_uuid(), "user_id": user_id, "token_digest": tokens.digest(t),
+                           "created_at": now, "expires_at": now + timedelta(days=1), "is_active": True}
+                          for t in user_tokens)
+        dataset.append({"id": user_id, "email": email, "tokens": user_tokens})
+    _bulk(db, models.User, user_rows)
+    _bulk(db, models.UserRole, user_role_rows)
+    _bulk(db, models.AuthToken, token_rows)
+    db.commit()
+    return dataset
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed demo ACL data or a synthetic benchmark dataset.")
+    parser.add_argument("--users", type=int, default=0, help="synthetic users (0 — демо-данные)")
+    parser.add_argument("--roles", type=int, default=10)
+    parser.add_argument("--resources", type=int, default=10)
+    parser.add_argument("--actions", type=int, default=4)
+    parser.add_argument("--tokens-per-user", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    upgrade(engine)
+    db = SessionLocal()
+    try:
+        if args.users:
+            seed_dataset(db, args.users, args.roles, args.resources, args.actions, args.tokens_per_user,
+                         seed=args.seed)
+        else:
+            seed_demo(db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
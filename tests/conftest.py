@@ -0,0 +1,25 @@
+"""Общая временная SQLite-база для тестов.
+
+Настройки читаются при импорте app, поэтому окружение задаётся здесь, до импорта тестовых модулей.
+"""
+import os
+import tempfile
+
+_db_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'auth.db')}"
+os.environ["DATABASE_REPLICA_URLS"] = "[]"
+os.environ["TOKEN_FORMAT"] = "opaque"
+os.environ["TOKEN_SLIDING_EXPIRY"] = "false"
+os.environ["CACHE_BACKEND"] = "local"
+os.environ["AUDIT_SINK"] = "off"
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def engine():
+    from app.database import engine
+    from app.migrations import upgrade
+
+    upgrade(engine)
+    return engine
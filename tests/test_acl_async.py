@@ -0,0 +1,70 @@
+"""ACLIndex под AsyncSession: параллельная сборка снимка не должна блокировать event loop."""
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.acl import ACLIndex
+from app.config import settings
+from app.database import async_database_url
+
+CONCURRENCY = 20
+TIMEOUT = 10
+
+
+def _run_loop(coro_fn):
+    # loop в отдельном потоке: зависший loop иначе не даст сработать ни одному таймауту
+    result = {}
+
+    def target():
+        result["value"] = asyncio.run(coro_fn())
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(TIMEOUT)
+    assert not thread.is_alive(), "event loop is stuck"
+    return result["value"]
+
+
+@pytest.fixture
+def async_engine(engine):
+    return create_async_engine(async_database_url(settings.DATABASE_URL))
+
+
+def test_concurrent_cold_get_does_not_block_loop(async_engine):
+    index = ACLIndex()
+
+    async def one():
+        async with AsyncSession(async_engine) as db:
+            return await db.run_sync(index.get)
+
+    async def main():
+        try:
+            return await asyncio.gather(*(one() for _ in range(CONCURRENCY)))
+        finally:
+            await async_engine.dispose()
+
+    compiled = _run_loop(main)
+    assert {c.version for c in compiled} == {0}
+
+
+def test_rebuild_during_gets_publishes_newest(async_engine):
+    index = ACLIndex()
+
+    async def get():
+        async with AsyncSession(async_engine) as db:
+            return await db.run_sync(index.get)
+
+    async def rebuild():
+        async with AsyncSession(async_engine) as db:
+            return await db.run_sync(index.rebuild)
+
+    async def main():
+        try:
+            await asyncio.gather(*(get() for _ in range(CONCURRENCY)), rebuild(), rebuild())
+            return await get()
+        finally:
+            await async_engine.dispose()
+
+    assert _run_loop(main).version == index.version >= 2
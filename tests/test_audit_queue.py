@@ -0,0 +1,47 @@
+"""audit.emit при полной очереди с policy="block": ожидание места не должно останавливать event loop."""
+import asyncio
+import time
+
+from app import audit
+from app.audit import AuditQueue
+
+BLOCK_TIMEOUT = 0.3
+
+
+def _full_queue(policy: str) -> AuditQueue:
+    queue = AuditQueue(maxsize=1, policy=policy, block_timeout=BLOCK_TIMEOUT, batch_size=100)
+    assert queue.offer({"event": "filler"})
+    return queue
+
+
+def test_block_policy_waits_off_the_loop(monkeypatch):
+    queue = _full_queue("block")
+    monkeypatch.setattr(audit, "enabled", True)
+    monkeypatch.setattr(audit, "audit_queue", queue)
+
+    async def ticker(ticks):
+        deadline = time.monotonic() + BLOCK_TIMEOUT / 2
+        while time.monotonic() < deadline:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+        # место освобождается, пока emit ещё ждёт
+        queue.take(1)
+
+    async def main():
+        ticks = []
+        await asyncio.gather(audit.emit(audit.LOGIN, "u1"), ticker(ticks))
+        return ticks
+
+    ticks = asyncio.run(main())
+    assert len(ticks) > 5
+    assert [e["event"] for e in queue.take(10)] == [audit.LOGIN]
+
+
+def test_drop_policy_does_not_wait(monkeypatch):
+    queue = _full_queue("drop")
+    monkeypatch.setattr(audit, "enabled", True)
+    monkeypatch.setattr(audit, "audit_queue", queue)
+    started = time.monotonic()
+    asyncio.run(audit.emit(audit.LOGIN, "u1"))
+    assert time.monotonic() - started < BLOCK_TIMEOUT
+    assert [e["event"] for e in queue.take(10)] == ["filler"]
@@ -0,0 +1,84 @@
+"""Число SQL-запросов на защищённый запрос: один на промахе кеша, ноль из кеша.
+
+/articles/ зависит от get_auth_context, get_current_user и require_permission сразу —
+аутентификация всё равно выполняется один раз на запрос, в том числе при отказе 403.
+"""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app import crud, models
+from app.cache import token_cache
+from app.database import SessionFactory
+from app.main import app
+
+
+@pytest.fixture(scope="module")
+def token(engine):
+    with SessionFactory() as db:
+        user = crud.create_user(db, email="user@example.com", password_hash="x", first_name="User")
+        role = models.Role(name="viewer")
+        article = models.Resource(name="article")
+        read = models.Permission(action="read")
+        db.add_all([role, article, read])
+        db.commit()
+        crud.create_role_permission(db, role.id, article.id, read.id)
+        db.add(models.UserRole(user_id=user.id, role_id=role.id))
+        db.commit()
+        return crud.create_token_for_user(db, user)[1]
+
+
+@pytest.fixture
+def statements(engine):
+    executed = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    yield executed
+    event.remove(engine, "before_cursor_execute", count)
+
+
+@pytest.fixture
+def client():
+    # без lifespan: фоновые воркеры и загрузка denylist к запросу отношения не имеют
+    return TestClient(app)
+
+
+# (метод, путь, ожидаемый статус): профиль, статьи с проверкой article:read и отказ в article:update
+REQUESTS = [
+    ("GET", "/auth/profile", 200),
+    ("GET", "/articles/", 200),
+    ("POST", "/articles/1/update", 403),
+]
+
+
+def _call(client, token, method, path, expected):
+    response = client.request(method, path, headers={"Authorization": f"Token {token}"})
+    assert response.status_code == expected, response.text
+    return response
+
+
+@pytest.mark.parametrize("method,path,expected", REQUESTS)
+def test_cold_request_is_one_statement(client, token, statements, method, path, expected):
+    token_cache.clear()
+    _call(client, token, method, path, expected)
+    assert len(statements) == 1, statements
+
+
+@pytest.mark.parametrize("method,path,expected", REQUESTS)
+def test_cached_request_is_zero_statements(client, token, statements, method, path, expected):
+    token_cache.clear()
+    _call(client, token, method, path, expected)
+    statements.clear()
+    _call(client, token, method, path, expected)
+    assert statements == []
+
+
+def test_articles_share_one_auth_context(client, token):
+    token_cache.clear()
+    body = _call(client, token, "GET", "/articles/", 200).json()
+    assert body["user_email"] == "user@example.com"
+    assert body["permission_checked"] is True
+    assert len(body["roles"]) == 1